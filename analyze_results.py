@@ -1,13 +1,29 @@
+import google.api_core.exceptions
 import google.cloud.storage as gcs
-import re
+import argparse
 import json
+import os
+import statistics
 import dataclasses
 import datetime
 import yaml
 
+from build_variants import BuildVariant
+from run_summary import MANIFEST_FILE, MANIFEST_VERSION, THORConfig, THORLogOutput
+
 
 DATASETS = ["full-month-small-cell"]
 
+STAGE_TIMES = [
+    "execution_time",
+    "range_and_shift_time",
+    "clustering_time",
+    "iod_time",
+    "total_od_time",
+    "total_attribution_time",
+    "merging_time",
+]
+
 @dataclasses.dataclass
 class BenchmarkParameters:
     instance_type: str
@@ -15,6 +31,11 @@ class BenchmarkParameters:
     dataset: str
     native_comp: bool
     use_mkl: bool
+    storage: str
+    tuning: str
+    build_variant: str
+    pack_jobs: int
+    zone: str
 
     @classmethod
     def from_gcs(cls, bucket: gcs.Bucket, dataset: str, instance_name: str):
@@ -27,15 +48,43 @@ class BenchmarkParameters:
             print(params_str)
             print(f'Error parsing JSON for {dataset}/{instance_name} ({params_file})')
             raise
+        return cls.from_dict(params)
+
+    @classmethod
+    def from_dict(cls, params: dict):
         return cls(
             instance_type=params['instance'],
             thor_version=params['thor_version'],
             dataset=params['dataset'],
             native_comp=params['native_comp'],
-            use_mkl=params['use_mkl']
+            use_mkl=params['use_mkl'],
+            # Runs from before --storage existed always used the boot disk.
+            storage=params.get('storage', 'boot'),
+            tuning="+".join(params.get('tuning', [])) or "none",
+            # Runs from before build variants only had --native-comp. --use-mkl
+            # installed MKL without numpy using it, so it is not a variant.
+            build_variant=params.get('build_variant', BuildVariant(native=params['native_comp']).name()),
+            pack_jobs=params.get('pack_jobs', 1),
+            # Runs from before zone failover all ran in us-central1-a.
+            zone=params.get('zone', 'us-central1-a'),
         )
 
 
+def load_manifest(bucket: gcs.Bucket, dataset: str, instance_name: str):
+    """
+    Load the run manifest written by run_summary.py on the instance, or
+    None for older runs that predate it.
+    """
+    manifest_file = bucket.blob(f'{dataset}/results/{instance_name}/{MANIFEST_FILE}')
+    try:
+        manifest = json.loads(manifest_file.download_as_string())
+    except google.api_core.exceptions.NotFound:
+        return None
+    if manifest['version'] > MANIFEST_VERSION:
+        raise ValueError(f'Unsupported manifest version {manifest["version"]} for {dataset}/{instance_name}')
+    return manifest
+
+
 def get_execution_time(bucket: gcs.Bucket, dataset: str, instance_name: str) -> int:
     start_time = bucket.blob(f'{dataset}/results/{instance_name}/thor-output/start_time.txt').download_as_string().decode('utf-8').strip()
     end_time = bucket.blob(f'{dataset}/results/{instance_name}/thor-output/end_time.txt').download_as_string().decode('utf-8').strip()
@@ -48,101 +97,11 @@ def get_execution_time(bucket: gcs.Bucket, dataset: str, instance_name: str) ->
     return seconds
 
 
-@dataclasses.dataclass
-class THORLogOutput:
-    n_obs: int
-    n_clusters: int
-    n_initial_orbits: int
-    n_orbits: int
-    n_merged_orbits: int
-    n_od_iterations: int
-    
-    range_and_shift_time: float
-    clustering_time: float
-    iod_time: float
-    total_od_time: float
-    total_attribution_time: float
-    merging_time: float
-
-    @classmethod
-    def from_lines(cls, lines: list[str]):
-        # 2023-06-28 14:11:42.684 [INFO] [140025143456192] Found 11153 observations. (main.py, rangeAndShift, 385)'
-        # 2023-06-28 14:11:42.684 [INFO] [140025143456192] Range and shift completed in 28.289 seconds. (main.py, rangeAndShift, 386)
-        # 2023-06-28 14:12:47.288 [INFO] [140025143456192] Found 1405 clusters. (main.py, clusterAndLink, 719)
-        # 2023-06-28 14:12:47.288 [INFO] [140025143456192] Clustering and restructuring completed in 63.647 seconds. (main.py, clusterAndLink, 720)
-        # 2023-06-28 14:12:51.176 [INFO] [140025143456192] Found 471 initial orbits. (iod.py, initialOrbitDetermination, 795)
-        # 2023-06-28 14:12:51.201 [INFO] [140025143456192] Initial orbit determination completed in 3.889 seconds. (iod.py, initialOrbitDetermination, 812)
-        # 2023-06-28 14:13:20.989 [INFO] [140025143456192] Differential correction completed in 29.712 seconds. (od.py, differentialCorrection, 801)
-        # 2023-06-28 14:13:21.908 [INFO] [140025143456192] Attribution completed in 0.855 seconds. (attribution.py, attributeObservations, 302)
-        # 2023-06-28 14:13:22.617 [INFO] [140025143456192] Differential correction completed in 0.600 seconds. (od.py, differentialCorrection, 801)
-        # 2023-06-28 14:13:23.467 [INFO] [140025143456192] Attribution completed in 0.794 seconds. (attribution.py, attributeObservations, 302)'
-        # 2023-06-28 14:13:28.351 [INFO] [140025143456192] Number of attribution / differential correction iterations: 5 (attribution.py, mergeAndExtendOrbits, 529)
-        # 2023-06-28 14:13:28.351 [INFO] [140025143456192] Extended and/or merged 9 orbits into 9 orbits. (attribution.py, mergeAndExtendOrbits, 534)
-        # 2023-06-28 14:13:28.351 [INFO] [140025143456192] Orbit extension and merging completed in 7.311 seconds. (attribution.py, mergeAndExtendOrbits, 539)
-        
-        n_obs_regex = re.compile(r'Found (\d+) observations.')
-        n_clusters_regex = re.compile(r'Found (\d+) clusters.')
-        n_initial_orbits_regex = re.compile(r'Found (\d+) initial orbits.')
-        n_orbits_regex = re.compile(r'Extended and/or merged (\d+) orbits into (\d+) orbits.')
-        n_od_iterations_regex = re.compile(r'Number of attribution / differential correction iterations: (\d+)')
-        
-        range_and_shift_regex = re.compile(r'Range and shift completed in (\d+\.\d+) seconds.')
-        clustering_regex = re.compile(r'Clustering and restructuring completed in (\d+\.\d+) seconds.')
-        iod_regex = re.compile(r'Initial orbit determination completed in (\d+\.\d+) seconds.')
-        od_regex = re.compile(r'Differential correction completed in (\d+\.\d+) seconds.')
-        attribution_regex = re.compile(r'Attribution completed in (\d+\.\d+) seconds.')
-        merging_regex = re.compile(r'Orbit extension and merging completed in (\d+\.\d+) seconds.')
-
-        matches = {
-            "total_od_time": 0,
-            "total_attribution_time": 0,
-        }
-        for line in lines:
-            if n_obs_regex.search(line):
-                matches['n_obs'] = int(n_obs_regex.search(line).group(1))
-            elif n_clusters_regex.search(line):
-                matches['n_clusters'] = int(n_clusters_regex.search(line).group(1))
-            elif n_initial_orbits_regex.search(line):
-                matches['n_initial_orbits'] = int(n_initial_orbits_regex.search(line).group(1))
-            elif n_orbits_regex.search(line):
-                matches['n_orbits'] = int(n_orbits_regex.search(line).group(1))
-                matches['n_merged_orbits'] = int(n_orbits_regex.search(line).group(2))
-            elif n_od_iterations_regex.search(line):
-                matches['n_od_iterations'] = int(n_od_iterations_regex.search(line).group(1)) or 1
-            elif range_and_shift_regex.search(line):
-                matches['range_and_shift_time'] = float(range_and_shift_regex.search(line).group(1))
-            elif clustering_regex.search(line):
-                matches['clustering_time'] = float(clustering_regex.search(line).group(1))
-            elif iod_regex.search(line):
-                matches['iod_time'] = float(iod_regex.search(line).group(1))
-            elif od_regex.search(line):
-                matches['total_od_time'] += float(od_regex.search(line).group(1))
-            elif attribution_regex.search(line):
-                matches['total_attribution_time'] += float(attribution_regex.search(line).group(1))
-            elif merging_regex.search(line):
-                matches['merging_time'] = float(merging_regex.search(line).group(1))
-
-        return cls(**matches)
+def analyze_thor_config(bucket: gcs.Bucket, dataset: str, instance_name: str):
+    config = yaml.safe_load(bucket.blob(f'{dataset}/results/{instance_name}/thor-output/thor/config.yml').download_as_string())
+    return THORConfig.from_dict(config)
 
 
-@dataclasses.dataclass
-class THORConfig:
-    cell_area: float
-    backend: str
-    cluster_min_obs: int
-    cluster_algorithm: str
-
-    @classmethod
-    def from_yaml(cls, bucket: gcs.Bucket, dataset: str, instance_name: str):
-        config = yaml.safe_load(bucket.blob(f'{dataset}/results/{instance_name}/thor-output/thor/config.yml').download_as_string())
-        return THORConfig(
-            cell_area=config["RANGE_SHIFT_CONFIG"]["cell_area"],
-            backend=config["RANGE_SHIFT_CONFIG"]["backend"],
-            cluster_min_obs=config["CLUSTER_LINK_CONFIG"]["min_obs"],
-            cluster_algorithm=config["CLUSTER_LINK_CONFIG"]["alg"],
-        )
-        
-
 def analyze_thor_output_logs(bucket: gcs.Bucket, dataset: str, instance_name: str):
     logs = bucket.blob(f'{dataset}/results/{instance_name}/thor-output/thor/orbit_00000000/thor.log').download_as_string()
     lines = logs.decode("utf8").split("\n")
@@ -155,7 +114,7 @@ def analyze_results(dataset: str, instance_name: str):
     params = BenchmarkParameters.from_gcs(bucket, dataset, instance_name)
     execution_time = get_execution_time(bucket, dataset, instance_name)
     log_output = analyze_thor_output_logs(bucket, dataset, instance_name)
-    thor_config = THORConfig.from_yaml(bucket, dataset, instance_name)
+    thor_config = analyze_thor_config(bucket, dataset, instance_name)
 
 
 @dataclasses.dataclass
@@ -165,7 +124,16 @@ class OutputLine:
     thor_version: str
     native_comp: bool
     use_mkl: bool
+    storage: str
+    tuning: str
+    build_variant: str
+    pack_jobs: int
+    zone: str
     dataset: str
+    cpu_platform: str
+    cpu_model: str
+    blas_libraries: str
+    fingerprint_id: str
     cell_area: float
     backend: str
     cluster_min_obs: int
@@ -183,20 +151,71 @@ class OutputLine:
     total_od_time: float
     total_attribution_time: float
     merging_time: float
+    peak_memory_kb: float
+    mean_cpu_steal: float
+    cpu_stall_fraction: float
+    memory_stall_fraction: float
+    ipc: float
 
     @classmethod
     def from_gcs(cls, bucket: gcs.Bucket, dataset: str, instance_name: str):
+        manifest = load_manifest(bucket, dataset, instance_name)
+        if manifest is not None:
+            return cls.from_manifest(manifest, dataset, instance_name)
+
         params = BenchmarkParameters.from_gcs(bucket, dataset, instance_name)
         execution_time = get_execution_time(bucket, dataset, instance_name)
         log_output = analyze_thor_output_logs(bucket, dataset, instance_name)
-        thor_config = THORConfig.from_yaml(bucket, dataset, instance_name)
+        thor_config = analyze_thor_config(bucket, dataset, instance_name)
+        return cls.from_parts(dataset, instance_name, params, execution_time, log_output, thor_config, None)
+
+    @classmethod
+    def from_manifest(cls, manifest: dict, dataset: str, instance_name: str):
+        return cls.from_parts(
+            dataset,
+            instance_name,
+            BenchmarkParameters.from_dict(manifest['parameters']),
+            manifest['timing']['execution_time'],
+            THORLogOutput(**manifest['log']),
+            THORConfig(**manifest['config']),
+            manifest,
+        )
+
+    @classmethod
+    def from_parts(
+        cls,
+        dataset: str,
+        instance_name: str,
+        params: BenchmarkParameters,
+        execution_time: float,
+        log_output: THORLogOutput,
+        thor_config: THORConfig,
+        manifest: dict | None,
+    ):
+        # Older manifests lack some sections, and runs from before
+        # manifests have none of them.
+        manifest = manifest or {}
+        fingerprint = manifest.get('fingerprint') or {}
+        resources = manifest.get('resources') or {}
+        packing = manifest.get('packing') or {}
+        cgroup = packing.get('cgroup') or {}
+        wall_usec = execution_time * 1e6
         return cls(
             instance_name=instance_name.split("-")[-1],
             instance_type=params.instance_type,
             thor_version=params.thor_version,
             native_comp=params.native_comp,
             use_mkl=params.use_mkl,
+            storage=params.storage,
+            tuning=params.tuning,
+            build_variant=params.build_variant,
+            pack_jobs=params.pack_jobs,
+            zone=params.zone,
             dataset=dataset,
+            cpu_platform=fingerprint.get('cpu_platform', ''),
+            cpu_model=fingerprint.get('cpu_model', ''),
+            blas_libraries=";".join(os.path.basename(l) for l in fingerprint.get('blas_libraries', [])),
+            fingerprint_id=fingerprint.get('id', ''),
             cell_area=thor_config.cell_area,
             backend=thor_config.backend,
             cluster_min_obs=thor_config.cluster_min_obs,
@@ -214,6 +233,18 @@ class OutputLine:
             total_od_time=log_output.total_od_time,
             total_attribution_time=log_output.total_attribution_time,
             merging_time=log_output.merging_time,
+            # A packed job's own cgroup peak when available, otherwise the
+            # peak for the whole instance.
+            peak_memory_kb=(
+                cgroup['memory_peak_bytes'] / 1024 if cgroup.get('memory_peak_bytes')
+                else resources.get('max_memory_used_kb', float('nan'))
+            ),
+            mean_cpu_steal=resources.get('mean_cpu_steal', float('nan')),
+            # Share of the run during which the job was stalled waiting for
+            # CPU or memory, only measured for packed jobs.
+            cpu_stall_fraction=cgroup['cpu_some_stall_usec'] / wall_usec if cgroup and wall_usec else float('nan'),
+            memory_stall_fraction=cgroup['memory_some_stall_usec'] / wall_usec if cgroup and wall_usec else float('nan'),
+            ipc=(packing.get('perf') or {}).get('ipc', float('nan')),
         )
 
     @classmethod
@@ -234,6 +265,42 @@ def all_results():
         for instance in instances:
             yield OutputLine.from_gcs(bucket, dataset, instance)
 
+def build_key(line: OutputLine) -> tuple:
+    return (line.dataset, line.instance_type, line.thor_version, line.native_comp, line.use_mkl, line.storage, line.tuning, line.build_variant)
+
+
+def fingerprint_summary(lines: list[OutputLine]):
+    """
+    Group runs by build, packing and environment fingerprint, and normalize
+    each group's median stage times by the median over all runs of the same
+    build, so that hardware variation within a machine type and slowdowns
+    from sharing an instance show up as ratios away from 1.0.
+    """
+    builds = {}
+    groups = {}
+    for line in lines:
+        builds.setdefault(build_key(line), []).append(line)
+        groups.setdefault(build_key(line) + (line.pack_jobs, line.fingerprint_id, line.cpu_platform), []).append(line)
+
+    for key, group in sorted(groups.items(), key=lambda kv: [str(k) for k in kv[0]]):
+        build = builds[key[:-3]]
+        row = list(key) + [len(group)]
+        for stage in STAGE_TIMES:
+            group_median = statistics.median(getattr(l, stage) for l in group)
+            build_median = statistics.median(getattr(l, stage) for l in build)
+            row.append(group_median)
+            row.append(group_median / build_median if build_median else float('nan'))
+        yield row
+
+
+def fingerprint_summary_header():
+    columns = ["dataset", "instance_type", "thor_version", "native_comp", "use_mkl", "storage", "tuning", "build_variant", "pack_jobs", "fingerprint_id", "cpu_platform", "n_runs"]
+    for stage in STAGE_TIMES:
+        columns.append(f"median_{stage}")
+        columns.append(f"relative_{stage}")
+    return ",".join(columns)
+
+
 def gcs_subdirs(bucket: gcs.Bucket, prefix: str):
     blobs = bucket.list_blobs(prefix=prefix, delimiter="/")
     # no-op to force the iterator to evaluate
@@ -244,7 +311,25 @@ def gcs_subdirs(bucket: gcs.Bucket, prefix: str):
 
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Summarize THOR benchmark results")
+    parser.add_argument(
+        "--by-fingerprint",
+        action="store_true",
+        dest="by_fingerprint",
+        help="Group runs by environment fingerprint and normalize timings per build",
+    )
+    return parser.parse_args()
+
+
 def main():
+    args = parse_args()
+    if args.by_fingerprint:
+        print(fingerprint_summary_header())
+        for row in fingerprint_summary(list(all_results())):
+            print(",".join(str(x) for x in row))
+        return
+
     print(OutputLine.header())
     for line in all_results():
         print(line.to_tsv())
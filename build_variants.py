@@ -0,0 +1,131 @@
+"""
+Build variants of numpy and oorb.
+
+A variant picks the BLAS/LAPACK backend numpy is linked against and the
+compiler options used for the Fortran oorb build. run_benchmark installs
+the variant and then verifies on the instance that it actually took effect.
+"""
+from __future__ import annotations
+
+import dataclasses
+
+PGO_PROFILE_DIR = "/opt/oorb-pgo"
+
+
+@dataclasses.dataclass
+class BlasBackend:
+    # apt packages providing the libraries
+    packages: list[str]
+    # numpy.distutils search order, see NPY_BLAS_ORDER / NPY_LAPACK_ORDER
+    blas_order: str
+    lapack_order: str
+    # substring of the library path numpy must have loaded at runtime
+    library_marker: str
+
+
+BLAS_BACKENDS = {
+    # The numpy wheel, which bundles its own OpenBLAS.
+    "default": BlasBackend([], "", "", "numpy.libs/libopenblas"),
+    "reference": BlasBackend(["libblas-dev", "liblapack-dev"], "blas", "lapack", "/blas/libblas"),
+    "openblas": BlasBackend(["libopenblas-dev"], "openblas", "openblas", "libopenblas"),
+    # Installed from Intel's repository by install_mkl.
+    "mkl": BlasBackend([], "mkl", "mkl", "libmkl"),
+    "blis": BlasBackend(["libblis-dev", "liblapack-dev"], "blis", "lapack", "libblis"),
+}
+
+OPT_LEVELS = ["O2", "O3", "Ofast"]
+
+
+@dataclasses.dataclass
+class BuildVariant:
+    blas: str = "default"
+    native: bool = False
+    opt_level: str | None = None
+    lto: bool = False
+    pgo: bool = False
+
+    def __post_init__(self):
+        # A native build compiles numpy from source, so it cannot use the
+        # OpenBLAS bundled with the wheel. Without an explicit backend it
+        # links the reference BLAS/LAPACK from liblapack-dev, as native
+        # builds always have.
+        if self.native and self.blas == "default":
+            self.blas = "reference"
+
+    @classmethod
+    def from_args(cls, args):
+        blas = args.blas
+        if args.use_mkl and blas == "default":
+            blas = "mkl"
+        if args.use_mkl and blas != "mkl":
+            raise ValueError(f"--use-mkl conflicts with --blas={args.blas}")
+        if blas == "mkl" and args.instance.startswith("t2a"):
+            raise ValueError("MKL is not available on ARM instances")
+        if args.pgo and not args.pgo_dataset:
+            raise ValueError("--pgo requires --pgo-dataset")
+        return cls(
+            blas=blas,
+            native=args.native_comp,
+            opt_level=args.opt_level,
+            lto=args.lto,
+            pgo=args.pgo,
+        )
+
+    @property
+    def backend(self) -> BlasBackend:
+        return BLAS_BACKENDS[self.blas]
+
+    def name(self) -> str:
+        """
+        Short label for the variant, eg 'openblas+native+O3+lto'.
+        """
+        parts = [self.blas]
+        if self.native:
+            parts.append("native")
+        if self.opt_level:
+            parts.append(self.opt_level)
+        if self.lto:
+            parts.append("lto")
+        if self.pgo:
+            parts.append("pgo")
+        return "+".join(parts)
+
+    def numpy_from_source(self) -> bool:
+        return self.blas != "default"
+
+    def numpy_build_env(self) -> str:
+        """
+        Shell prefix selecting the BLAS/LAPACK libraries for a numpy source build.
+        """
+        if self.blas == "default":
+            return ""
+        env = f"export NPY_BLAS_ORDER={self.backend.blas_order} NPY_LAPACK_ORDER={self.backend.lapack_order} && "
+        if self.blas == "mkl":
+            env = "source /opt/intel/oneapi/setvars.sh > /dev/null && " + env
+        return env
+
+    def oorb_flags(self, pgo_phase: str | None = None) -> list[str]:
+        """
+        Extra gfortran options appended to oorb's optimized FCOPTIONS.
+
+        Args:
+            pgo_phase: "generate" for the instrumented training build, "use"
+                for the final build, or None when not building for PGO.
+        """
+        flags = []
+        if self.native:
+            flags.append("-march=native")
+        if self.opt_level:
+            # Later -O options override the one from FCOPTIONS_OPT_GFORTRAN.
+            flags.append(f"-{self.opt_level}")
+        if self.lto:
+            flags.append("-flto")
+        if pgo_phase == "generate":
+            flags.append(f"-fprofile-generate={PGO_PROFILE_DIR}")
+        elif pgo_phase == "use":
+            flags.extend([
+                f"-fprofile-use={PGO_PROFILE_DIR}",
+                "-fprofile-partial-training",
+                "-Wno-missing-profile",
+            ])
+        return flags
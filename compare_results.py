@@ -0,0 +1,285 @@
+"""
+Compare THOR benchmark results between a baseline and a candidate version.
+
+Runs of the two versions are paired up when they used the same dataset,
+instance type, build flags and THOR config. For every stage, the relative
+change in median time (and in peak memory) is estimated per pair group and
+across all groups, with bootstrap confidence intervals. The report is
+written as JSON and the exit code tells a release check whether the
+candidate regressed:
+
+    0  no significant regressions
+    1  at least one significant regression, in any group or across all
+       groups (only across all groups with --gate=pooled)
+    2  no comparable runs, nothing could be concluded
+"""
+from __future__ import annotations
+
+import argparse
+import dataclasses
+import json
+import math
+import random
+import statistics
+import sys
+
+import analyze_results
+from analyze_results import OutputLine
+
+# Runs are only compared when all of these match.
+PAIRING_FIELDS = [
+    "dataset",
+    "instance_type",
+    "native_comp",
+    "use_mkl",
+    "storage",
+    "tuning",
+    "build_variant",
+    "pack_jobs",
+    "cell_area",
+    "backend",
+    "cluster_min_obs",
+    "cluster_algorithm",
+]
+
+MEMORY_METRIC = "peak_memory_kb"
+METRICS = analyze_results.STAGE_TIMES + [MEMORY_METRIC]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Compare THOR benchmark results between two thor versions"
+    )
+    parser.add_argument(
+        "-b", "--baseline", type=str, required=True, help="Baseline thor version (git SHA, may be abbreviated)"
+    )
+    parser.add_argument(
+        "-c", "--candidate", type=str, required=True, help="Candidate thor version (git SHA, may be abbreviated)"
+    )
+    parser.add_argument(
+        "--max-slowdown",
+        type=float,
+        default=0.05,
+        dest="max_slowdown",
+        help="Relative slowdown of a stage that counts as a regression (default: 0.05)",
+    )
+    parser.add_argument(
+        "--max-memory-increase",
+        type=float,
+        default=0.10,
+        dest="max_memory_increase",
+        help="Relative increase in peak memory that counts as a regression (default: 0.10)",
+    )
+    parser.add_argument(
+        "--confidence",
+        type=float,
+        default=0.95,
+        help="Confidence level of the bootstrap intervals (default: 0.95)",
+    )
+    parser.add_argument(
+        "--n-bootstrap",
+        type=int,
+        default=2000,
+        dest="n_bootstrap",
+        help="Number of bootstrap resamples (default: 2000)",
+    )
+    parser.add_argument(
+        "--min-runs",
+        type=int,
+        default=2,
+        dest="min_runs",
+        help="Minimum runs of each version for a group to be compared (default: 2)",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="Random seed for the bootstrap"
+    )
+    parser.add_argument(
+        "--gate",
+        type=str,
+        choices=["group", "pooled"],
+        default="group",
+        help="Fail on a regression in any single group, or only on one across all groups (default: group)",
+    )
+    parser.add_argument(
+        "-o", "--output", type=str, default=None, help="Write the report here instead of stdout"
+    )
+    return parser.parse_args()
+
+
+def same_version(recorded: str, requested: str) -> bool:
+    return recorded.startswith(requested) or requested.startswith(recorded)
+
+
+def pair_runs(lines: list[OutputLine], baseline: str, candidate: str) -> dict[tuple, tuple[list, list]]:
+    """
+    Group runs by PAIRING_FIELDS into (baseline runs, candidate runs).
+    """
+    groups = {}
+    for line in lines:
+        if same_version(line.thor_version, baseline):
+            side = 0
+        elif same_version(line.thor_version, candidate):
+            side = 1
+        else:
+            continue
+        key = tuple(getattr(line, field) for field in PAIRING_FIELDS)
+        groups.setdefault(key, ([], []))[side].append(line)
+    return groups
+
+
+def values(lines: list[OutputLine], metric: str) -> list[float]:
+    return [v for v in (getattr(line, metric) for line in lines) if not math.isnan(v)]
+
+
+def log_ratio(baseline: list[float], candidate: list[float]) -> float:
+    return math.log(statistics.median(candidate) / statistics.median(baseline))
+
+
+def resample(rng: random.Random, xs: list[float]) -> list[float]:
+    return [rng.choice(xs) for _ in xs]
+
+
+@dataclasses.dataclass
+class Change:
+    relative_change: float
+    ci_low: float
+    ci_high: float
+    verdict: str
+
+    @classmethod
+    def from_log_ratios(cls, estimate: float, bootstrap: list[float], confidence: float, threshold: float):
+        """
+        Turn a log ratio of medians and its bootstrap distribution into a
+        relative change with a percentile confidence interval. A change is
+        only a regression when the whole interval is above zero and the
+        estimate is past the threshold, and likewise for improvements.
+        """
+        bootstrap = sorted(bootstrap)
+        alpha = (1 - confidence) / 2
+        low = bootstrap[int(alpha * (len(bootstrap) - 1))]
+        high = bootstrap[int(math.ceil((1 - alpha) * (len(bootstrap) - 1)))]
+        relative_change = math.exp(estimate) - 1
+        ci_low = math.exp(low) - 1
+        ci_high = math.exp(high) - 1
+        if ci_low > 0 and relative_change > threshold:
+            verdict = "regression"
+        elif ci_high < 0 and relative_change < -threshold:
+            verdict = "improvement"
+        else:
+            verdict = "no significant change"
+        return cls(
+            relative_change=round(relative_change, 4),
+            ci_low=round(ci_low, 4),
+            ci_high=round(ci_high, 4),
+            verdict=verdict,
+        )
+
+
+def compare(groups: dict[tuple, tuple[list, list]], args) -> dict:
+    rng = random.Random(args.seed)
+    thresholds = {metric: args.max_slowdown for metric in analyze_results.STAGE_TIMES}
+    thresholds[MEMORY_METRIC] = args.max_memory_increase
+
+    group_reports = []
+    group_regressions = []
+    skipped = []
+    overall = {metric: {"estimates": [], "bootstraps": []} for metric in METRICS}
+    for key, (baseline, candidate) in sorted(groups.items(), key=lambda kv: [str(k) for k in kv[0]]):
+        description = dict(zip(PAIRING_FIELDS, key))
+        if len(baseline) < args.min_runs or len(candidate) < args.min_runs:
+            skipped.append(dict(description, n_baseline=len(baseline), n_candidate=len(candidate)))
+            continue
+
+        metrics = {}
+        for metric in METRICS:
+            b = values(baseline, metric)
+            c = values(candidate, metric)
+            if len(b) < args.min_runs or len(c) < args.min_runs or not all(b) or not all(c):
+                continue
+            estimate = log_ratio(b, c)
+            bootstrap = [log_ratio(resample(rng, b), resample(rng, c)) for _ in range(args.n_bootstrap)]
+            metrics[metric] = dataclasses.asdict(
+                Change.from_log_ratios(estimate, bootstrap, args.confidence, thresholds[metric])
+            )
+            overall[metric]["estimates"].append(estimate)
+            overall[metric]["bootstraps"].append(bootstrap)
+            if metrics[metric]["verdict"] == "regression":
+                group_regressions.append(dict(description, metric=metric))
+
+        group_reports.append(dict(
+            description,
+            n_baseline=len(baseline),
+            n_candidate=len(candidate),
+            metrics=metrics,
+        ))
+
+    # The verdict across all groups uses the geometric mean of the per-group
+    # ratios, bootstrapped by resampling within each group.
+    stages = {}
+    for metric, results in overall.items():
+        if not results["estimates"]:
+            continue
+        estimate = statistics.mean(results["estimates"])
+        bootstrap = [statistics.mean(sample) for sample in zip(*results["bootstraps"])]
+        stages[metric] = dict(
+            dataclasses.asdict(Change.from_log_ratios(estimate, bootstrap, args.confidence, thresholds[metric])),
+            n_groups=len(results["estimates"]),
+        )
+
+    return {
+        "baseline": args.baseline,
+        "candidate": args.candidate,
+        "thresholds": {
+            "max_slowdown": args.max_slowdown,
+            "max_memory_increase": args.max_memory_increase,
+            "confidence": args.confidence,
+            "min_runs": args.min_runs,
+        },
+        "stages": stages,
+        "regressions": sorted(metric for metric, result in stages.items() if result["verdict"] == "regression"),
+        # A large regression in one dataset or instance type can be averaged
+        # away across groups, so these are listed separately.
+        "group_regressions": group_regressions,
+        "groups": group_reports,
+        "skipped_groups": skipped,
+    }
+
+
+def exit_code(report: dict, gate: str) -> int:
+    if not report["stages"]:
+        return 2
+    if report["regressions"]:
+        return 1
+    if gate == "group" and report["group_regressions"]:
+        return 1
+    return 0
+
+
+def main():
+    args = parse_args()
+    groups = pair_runs(list(analyze_results.all_results()), args.baseline, args.candidate)
+    report = compare(groups, args)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    for metric, result in report["stages"].items():
+        print(
+            f"{metric}: {result['verdict']} ({result['relative_change']:+.1%}, "
+            f"CI {result['ci_low']:+.1%} to {result['ci_high']:+.1%}, {result['n_groups']} groups)",
+            file=sys.stderr,
+        )
+
+    for regression in report["group_regressions"]:
+        group = ", ".join(f"{field}={regression[field]}" for field in PAIRING_FIELDS)
+        print(f"{regression['metric']}: regression in {group}", file=sys.stderr)
+
+    sys.exit(exit_code(report, args.gate))
+
+
+if __name__ == "__main__":
+    main()
@@ -5,9 +5,31 @@ import sys
 from typing import Any
 import warnings
 
+from google.api_core import exceptions
 from google.api_core.extended_operation import ExtendedOperation
 from google.cloud import compute_v1
 
+# Operation error codes meaning the zone cannot provide the instance right
+# now, as opposed to a problem with the request itself.
+CAPACITY_ERROR_CODES = [
+    "ZONE_RESOURCE_POOL_EXHAUSTED",
+    "ZONE_RESOURCE_POOL_EXHAUSTED_WITH_DETAILS",
+    "QUOTA_EXCEEDED",
+    "RESOURCE_EXHAUSTED",
+]
+
+
+class CapacityError(Exception):
+    """
+    The zone cannot host the requested instance: it is out of capacity,
+    the project is over quota, or the zone does not offer the machine type.
+    """
+
+    def __init__(self, zone: str, code: str, message: str):
+        super().__init__(f"{zone}: [{code}] {message}")
+        self.zone = zone
+        self.code = code
+
 
 def service_account(email: str, scopes: list[str]) -> compute_v1.ServiceAccount:
     return compute_v1.ServiceAccount(email=email, scopes=scopes)
@@ -68,6 +90,60 @@ def disk_from_image(
     return boot_disk
 
 
+def empty_disk(
+    disk_type: str,
+    disk_size_gb: int,
+    device_name: str,
+    auto_delete: bool = True,
+) -> compute_v1.AttachedDisk:
+    """
+    Create an AttachedDisk object to be used in VM instance creation. The created disk contains
+    no data and requires formatting before it can be used.
+
+    Args:
+        disk_type: the type of disk you want to create. This value uses the following format:
+            "zones/{zone}/diskTypes/(pd-standard|pd-ssd|pd-balanced|pd-extreme)".
+            For example: "zones/us-west3-b/diskTypes/pd-ssd"
+        disk_size_gb: size of the new disk in gigabytes
+        device_name: name the disk is exposed under in the guest, as
+            "/dev/disk/by-id/google-{device_name}"
+        auto_delete: boolean flag indicating whether this disk should be deleted with the VM that uses it
+
+    Returns:
+        AttachedDisk object configured to be created as an empty disk.
+    """
+    scratch_disk = compute_v1.AttachedDisk()
+    initialize_params = compute_v1.AttachedDiskInitializeParams()
+    initialize_params.disk_type = disk_type
+    initialize_params.disk_size_gb = disk_size_gb
+    scratch_disk.initialize_params = initialize_params
+    scratch_disk.device_name = device_name
+    scratch_disk.auto_delete = auto_delete
+    scratch_disk.boot = False
+    return scratch_disk
+
+
+def local_ssd_disk(zone: str) -> compute_v1.AttachedDisk:
+    """
+    Create an AttachedDisk object to be used in VM instance creation. The created disk
+    is a 375 GB local NVMe SSD that is deleted together with the VM.
+
+    Args:
+        zone: The zone in which the local SSD drive will be attached.
+
+    Returns:
+        AttachedDisk object configured as a local SSD disk.
+    """
+    disk = compute_v1.AttachedDisk()
+    disk.type_ = compute_v1.AttachedDisk.Type.SCRATCH.name
+    initialize_params = compute_v1.AttachedDiskInitializeParams()
+    initialize_params.disk_type = f"zones/{zone}/diskTypes/local-ssd"
+    disk.initialize_params = initialize_params
+    disk.interface = compute_v1.AttachedDisk.Interface.NVME.name
+    disk.auto_delete = True
+    return disk
+
+
 def wait_for_extended_operation(
     operation: ExtendedOperation, verbose_name: str = "operation", timeout: int = 300
 ) -> Any:
@@ -116,6 +192,18 @@ def wait_for_extended_operation(
     return result
 
 
+def operation_errors(operation: ExtendedOperation) -> list[tuple[str, str]]:
+    """
+    The (code, message) of each error a finished operation reports, eg
+    ("ZONE_RESOURCE_POOL_EXHAUSTED", "..."). operation.error_code is only
+    the HTTP status, the reason is in the operation's error details.
+    """
+    error = getattr(operation, "error", None)
+    if not error:
+        return []
+    return [(entry.code, entry.message) for entry in error.errors]
+
+
 def create_instance(
     project_id: str,
     zone: str,
@@ -174,6 +262,10 @@ def create_instance(
             protected against deletion or not.
     Returns:
         Instance object.
+
+    Raises:
+        CapacityError if the zone is out of capacity, the project is over
+        quota, or the zone does not offer the machine type.
     """
     instance_client = compute_v1.InstancesClient()
 
@@ -244,9 +336,24 @@ def create_instance(
     # Wait for the create operation to complete.
     print(f"Creating the {instance_name} instance in {zone}...")
 
-    operation = instance_client.insert(request=request)
-
-    wait_for_extended_operation(operation, "instance creation")
+    try:
+        operation = instance_client.insert(request=request)
+    except exceptions.NotFound as e:
+        if "machineTypes" in str(e):
+            raise CapacityError(zone, "MACHINE_TYPE_NOT_OFFERED", str(e)) from e
+        raise
+    except exceptions.Forbidden as e:
+        if "Quota" in str(e):
+            raise CapacityError(zone, "QUOTA_EXCEEDED", str(e)) from e
+        raise
+
+    try:
+        wait_for_extended_operation(operation, "instance creation")
+    except Exception as e:
+        for code, message in operation_errors(operation):
+            if code in CAPACITY_ERROR_CODES:
+                raise CapacityError(zone, code, message) from e
+        raise
 
     print(f"Instance {instance_name} created.")
     return instance_client.get(project=project_id, zone=zone, instance=instance_name)
@@ -0,0 +1,317 @@
+"""
+Hardware and software environment fingerprint of a benchmark instance.
+
+Copied onto the benchmark instance alongside run_summary.py. Two runs of the
+same machine type can land on different CPU platforms or end up linking a
+different BLAS, so each run records what it actually ran on.
+"""
+from __future__ import annotations
+
+import argparse
+import dataclasses
+import glob
+import hashlib
+import importlib.metadata
+import importlib.util
+import os
+import json
+import platform
+import re
+import subprocess
+import sys
+import urllib.request
+
+METADATA_URL = "http://metadata.google.internal/computeMetadata/v1/instance/"
+OORB_MAKEFILE = "/opt/oorb/Makefile.include"
+
+
+def run_quiet(args: list[str]) -> str:
+    try:
+        proc = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except FileNotFoundError:
+        return ""
+    if proc.returncode != 0:
+        return ""
+    return proc.stdout.decode("utf-8")
+
+
+def instance_metadata(key: str) -> str:
+    request = urllib.request.Request(METADATA_URL + key, headers={"Metadata-Flavor": "Google"})
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.read().decode("utf-8").strip()
+    except OSError:
+        return ""
+
+
+def lscpu_fields() -> dict[str, str]:
+    output = run_quiet(["lscpu", "-J"])
+    if not output:
+        return {}
+    # util-linux 2.37 (Ubuntu 22.04) nests most fields under "children"
+    # of their section, 2.38 and later print them flat again.
+    fields = {}
+    entries = list(json.loads(output)["lscpu"])
+    while entries:
+        entry = entries.pop(0)
+        if entry.get("data") is not None:
+            fields.setdefault(entry["field"].rstrip(":"), entry["data"])
+        entries.extend(entry.get("children", []))
+    return fields
+
+
+def memory_total_kb() -> int:
+    with open("/proc/meminfo") as f:
+        for line in f:
+            if line.startswith("MemTotal:"):
+                return int(line.split()[1])
+    return 0
+
+
+def read_sysfs(path: str) -> str:
+    try:
+        with open(path) as f:
+            value = f.read().strip()
+    except OSError:
+        return ""
+    # eg 'always [madvise] never' -> 'madvise'
+    match = re.search(r"\[(\S+)\]", value)
+    return match.group(1) if match else value
+
+
+def native_march() -> str:
+    # What gcc resolves '-march=native' to on this host, e.g. 'cascadelake'.
+    output = run_quiet(["gcc", "-march=native", "-Q", "--help=target"])
+    match = re.search(r"^\s+-march=\s+(\S+)", output, re.MULTILINE)
+    return match.group(1) if match else ""
+
+
+def oorb_fcoptions() -> str:
+    try:
+        with open(OORB_MAKEFILE) as f:
+            makefile = f.read()
+    except OSError:
+        return ""
+    match = re.search(r"^FCOPTIONS\s*=\s*(.*)$", makefile, re.MULTILINE)
+    return match.group(1).strip() if match else ""
+
+
+def pyoorb_library() -> str:
+    spec = importlib.util.find_spec("pyoorb")
+    if spec is None or spec.origin is None:
+        return ""
+    if spec.origin.endswith(".so"):
+        return spec.origin
+    # A package wrapping the extension module.
+    libraries = sorted(glob.glob(os.path.join(os.path.dirname(spec.origin), "*.so")))
+    return libraries[0] if libraries else ""
+
+
+def pyoorb_build_flags() -> list[str]:
+    """
+    Compiler options recorded in the installed pyoorb extension. oorb is
+    built with -frecord-gcc-switches, which stores every compilation's
+    options in the .GCC.command.line section.
+    """
+    library = pyoorb_library()
+    if not library:
+        return []
+    output = run_quiet(["readelf", "-p", ".GCC.command.line", library])
+    # [     0]  -march=cascadelake -mmmx ... -O3 -flto
+    flags = []
+    for line in output.splitlines():
+        if "]" in line:
+            flags.extend(line.split("]", 1)[1].split())
+    return sorted(set(flags))
+
+
+def numpy_build_info() -> dict:
+    """
+    Describe the numpy build and the BLAS/LAPACK libraries it actually
+    loaded at runtime, which is not necessarily what it was built against.
+    """
+    try:
+        import numpy
+        import numpy.linalg  # noqa: F401 - make sure the BLAS/LAPACK libraries are loaded
+    except ImportError:
+        return {"version": "", "cpu_baseline": [], "cpu_dispatch": [], "blas_libraries": []}
+
+    from numpy.core import _multiarray_umath
+
+    with open("/proc/self/maps") as f:
+        maps = f.read()
+    blas_libraries = sorted(set(
+        re.findall(r"(\S*lib(?:open)?blas\S*\.so\S*|\S*libmkl\S*\.so\S*|\S*libblis\S*\.so\S*|\S*liblapack\S*\.so\S*)", maps)
+    ))
+    return {
+        "version": numpy.__version__,
+        "cpu_baseline": list(getattr(_multiarray_umath, "__cpu_baseline__", [])),
+        "cpu_dispatch": list(getattr(_multiarray_umath, "__cpu_dispatch__", [])),
+        "blas_libraries": blas_libraries,
+    }
+
+
+def installed_packages() -> dict[str, str]:
+    return {
+        dist.metadata["Name"]: dist.version
+        for dist in importlib.metadata.distributions()
+        if dist.metadata["Name"]
+    }
+
+
+@dataclasses.dataclass
+class Fingerprint:
+    cpu_platform: str
+    cpu_model: str
+    cpu_flags: list[str]
+    architecture: str
+    n_cpus: int
+    sockets: int
+    cores_per_socket: int
+    threads_per_core: int
+    numa_nodes: int
+    memory_total_kb: int
+    kernel: str
+    transparent_hugepage: str
+    smt_control: str
+    scaling_governor: str
+    python_version: str
+    native_march: str
+    numpy_version: str
+    numpy_cpu_baseline: list[str]
+    numpy_cpu_dispatch: list[str]
+    blas_libraries: list[str]
+    oorb_fcoptions: str
+    packages: dict[str, str]
+
+    @classmethod
+    def collect(cls):
+        lscpu = lscpu_fields()
+        numpy_info = numpy_build_info()
+        return cls(
+            # eg 'Intel Cascade Lake', only available on GCE.
+            cpu_platform=instance_metadata("cpu-platform"),
+            cpu_model=lscpu.get("Model name", ""),
+            cpu_flags=sorted(lscpu.get("Flags", "").split()),
+            architecture=platform.machine(),
+            n_cpus=int(lscpu.get("CPU(s)", 0)),
+            sockets=int(lscpu.get("Socket(s)", 0)),
+            cores_per_socket=int(lscpu.get("Core(s) per socket", 0)),
+            threads_per_core=int(lscpu.get("Thread(s) per core", 0)),
+            numa_nodes=int(lscpu.get("NUMA node(s)", 0)),
+            memory_total_kb=memory_total_kb(),
+            kernel=platform.release(),
+            transparent_hugepage=read_sysfs("/sys/kernel/mm/transparent_hugepage/enabled"),
+            smt_control=read_sysfs("/sys/devices/system/cpu/smt/control"),
+            scaling_governor=read_sysfs("/sys/devices/system/cpu/cpu0/cpufreq/scaling_governor"),
+            python_version=platform.python_version(),
+            native_march=native_march(),
+            numpy_version=numpy_info["version"],
+            numpy_cpu_baseline=numpy_info["cpu_baseline"],
+            numpy_cpu_dispatch=numpy_info["cpu_dispatch"],
+            blas_libraries=numpy_info["blas_libraries"],
+            oorb_fcoptions=oorb_fcoptions(),
+            packages=installed_packages(),
+        )
+
+    def fingerprint_id(self) -> str:
+        """
+        Short stable hash of the fields that are expected to affect
+        performance. Runs with the same id ran on equivalent hardware with
+        equivalent builds of numpy and oorb. Host tuning state is left out,
+        it is recorded as a run parameter instead.
+        """
+        key = json.dumps(
+            [
+                self.cpu_platform,
+                self.cpu_model,
+                self.architecture,
+                # Physical topology only, no-smt changes the logical CPU count.
+                self.sockets,
+                self.cores_per_socket,
+                self.numa_nodes,
+                self.kernel,
+                self.native_march,
+                self.numpy_version,
+                self.numpy_cpu_baseline,
+                self.blas_libraries,
+                self.oorb_fcoptions,
+            ]
+        )
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()[:10]
+
+    def to_dict(self) -> dict:
+        fingerprint = dataclasses.asdict(self)
+        fingerprint["id"] = self.fingerprint_id()
+        return fingerprint
+
+
+def verify_build(blas_marker: str | None, oorb_flags: list[str]) -> list[str]:
+    """
+    Check that numpy loaded the expected BLAS and that the installed pyoorb
+    was compiled with the expected options. Returns a list of problems.
+    """
+    problems = []
+    if blas_marker is not None:
+        blas_libraries = numpy_build_info()["blas_libraries"]
+        if not any(blas_marker in library for library in blas_libraries):
+            problems.append(f"numpy loaded {blas_libraries}, expected a library matching '{blas_marker}'")
+
+    if not oorb_flags:
+        return problems
+    build_flags = pyoorb_build_flags()
+    if not build_flags:
+        problems.append(f"no compiler options recorded in pyoorb library '{pyoorb_library()}'")
+        return problems
+    for flag in oorb_flags:
+        if flag.startswith("-W"):
+            # Warning options are not recorded.
+            continue
+        accepted = [flag]
+        if flag == "-march=native":
+            # The driver expands -march=native before the options are recorded.
+            accepted.append(f"-march={native_march()}")
+        elif flag == "-flto":
+            # With LTO only the link-time code generation, run with -fltrans,
+            # leaves its options in the library.
+            accepted.append("-fltrans")
+        if not any(a in build_flags for a in accepted):
+            problems.append(f"pyoorb was not compiled with {flag}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Print the environment fingerprint of this instance"
+    )
+    parser.add_argument(
+        "--expect-blas",
+        type=str,
+        default=None,
+        dest="expect_blas",
+        help="Fail unless numpy loaded a BLAS library whose path contains this string",
+    )
+    parser.add_argument(
+        "--expect-oorb-flag",
+        type=str,
+        action="append",
+        default=[],
+        dest="expect_oorb_flags",
+        help="Fail unless the installed pyoorb was compiled with this flag (may be repeated)",
+    )
+    args = parser.parse_args()
+
+    if args.expect_blas is None and not args.expect_oorb_flags:
+        print(json.dumps(Fingerprint.collect().to_dict(), indent=2))
+        return
+
+    problems = verify_build(args.expect_blas, args.expect_oorb_flags)
+    for problem in problems:
+        print(problem, file=sys.stderr)
+    if problems:
+        sys.exit(1)
+    print("build verified")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""
+Run several THOR benchmark jobs at the same time on one instance.
+
+run_benchmark starts this on the instance for --pack-dataset runs. Each job
+gets a disjoint set of physical cores and a share of memory through its own
+systemd scope (a cpuset and memory cgroup), and its own data and output
+directories. While the jobs run, cgroup CPU usage and pressure stall
+information are sampled so each job's output records how much it was
+slowed down by its neighbours.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import time
+
+from fingerprint import memory_total_kb
+from run_summary import PACKING_FILE
+
+SLICE = "thor.slice"
+POLL_SECONDS = 10
+
+
+def physical_cores() -> list[tuple[int, list[int]]]:
+    """
+    Return (NUMA node, logical CPUs) for every physical core, ordered by
+    node and core so that neighbouring cores end up in the same job.
+    """
+    proc = subprocess.run(["lscpu", "-p=CPU,CORE,NODE"], stdout=subprocess.PIPE, check=True)
+    cores = {}
+    for line in proc.stdout.decode("utf-8").splitlines():
+        if line.startswith("#"):
+            continue
+        cpu, core, node = line.split(",")
+        cores.setdefault((int(node or 0), int(core)), []).append(int(cpu))
+    return [(node, sorted(cpus)) for (node, _), cpus in sorted(cores.items())]
+
+
+def partition(items: list, n: int) -> list[list]:
+    if n > len(items):
+        raise ValueError(f"Cannot pack {n} jobs onto {len(items)} physical cores")
+    size, extra = divmod(len(items), n)
+    chunks = []
+    start = 0
+    for i in range(n):
+        end = start + size + (1 if i < extra else 0)
+        chunks.append(items[start:end])
+        start = end
+    return chunks
+
+
+def perf_available() -> bool:
+    if shutil.which("perf") is None:
+        return False
+    proc = subprocess.run(
+        ["perf", "stat", "-e", "cycles,instructions", "true"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    return proc.returncode == 0 and b"not supported" not in proc.stderr
+
+
+def read_pressure(path: str) -> dict[str, int]:
+    # some avg10=0.00 avg60=0.00 avg300=0.00 total=12345
+    # full avg10=0.00 avg60=0.00 avg300=0.00 total=6789
+    pressure = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                kind, *fields = line.split()
+                pressure[kind] = int(dict(field.split("=") for field in fields)["total"])
+    except OSError:
+        pass
+    return pressure
+
+
+def read_flat_keyed(path: str) -> dict[str, int]:
+    try:
+        with open(path) as f:
+            return {key: int(value) for key, value in (line.split() for line in f)}
+    except OSError:
+        return {}
+
+
+def read_int(path: str) -> int:
+    try:
+        with open(path) as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return 0
+
+
+def sample_cgroup(unit: str) -> dict:
+    cgroup = f"/sys/fs/cgroup/{SLICE}/{unit}.scope"
+    cpu_pressure = read_pressure(f"{cgroup}/cpu.pressure")
+    memory_pressure = read_pressure(f"{cgroup}/memory.pressure")
+    io_pressure = read_pressure(f"{cgroup}/io.pressure")
+    return {
+        "cpu_usage_usec": read_flat_keyed(f"{cgroup}/cpu.stat").get("usage_usec", 0),
+        "cpu_some_stall_usec": cpu_pressure.get("some", 0),
+        "memory_some_stall_usec": memory_pressure.get("some", 0),
+        "memory_full_stall_usec": memory_pressure.get("full", 0),
+        "io_some_stall_usec": io_pressure.get("some", 0),
+        "memory_peak_bytes": read_int(f"{cgroup}/memory.peak"),
+    }
+
+
+def read_perf_stat(path: str) -> dict[str, float]:
+    """
+    Parse `perf stat -x,` output into instructions per cycle. A lower IPC
+    than the same job on a dedicated instance points at contention for
+    caches and memory bandwidth.
+    """
+    counters = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                fields = line.strip().split(",")
+                if len(fields) < 3 or line.startswith("#"):
+                    continue
+                try:
+                    counters[fields[2].split(":")[0]] = float(fields[0])
+                except ValueError:
+                    # <not counted> / <not supported>
+                    continue
+    except OSError:
+        return {}
+    if not counters.get("cycles") or "instructions" not in counters:
+        return {}
+    return {
+        "cycles": counters["cycles"],
+        "instructions": counters["instructions"],
+        "ipc": round(counters["instructions"] / counters["cycles"], 3),
+    }
+
+
+def timed_command(command: str, output_dir: str) -> str:
+    # Note the start and end time the same way a dedicated run does, rather
+    # than at the granularity of the polling loop.
+    return (
+        f"date > {output_dir}/start_time.txt; {command}; status=$?; "
+        f"date > {output_dir}/end_time.txt; exit $status"
+    )
+
+
+def run_jobs(jobs: list[dict]):
+    slots = partition(physical_cores(), len(jobs))
+    memory_max_kb = int(memory_total_kb() * 0.9 / len(jobs))
+    use_perf = perf_available()
+
+    running = {}
+    for slot, (job, cores) in enumerate(zip(jobs, slots)):
+        cpus = sorted(cpu for _, core_cpus in cores for cpu in core_cpus)
+        nodes = sorted({node for node, _ in cores})
+        unit = f"thor-pack-{slot}"
+        perf = []
+        if use_perf:
+            perf = ["perf", "stat", "-x,", "-e", "cycles,instructions", "-o", f"{job['output_dir']}/perf-stat.csv", "--"]
+        args = [
+            "sudo", "systemd-run", "--scope", "--quiet",
+            f"--unit={unit}",
+            f"--slice={SLICE}",
+            "-p", f"AllowedCPUs={','.join(str(c) for c in cpus)}",
+            "-p", f"AllowedMemoryNodes={','.join(str(n) for n in nodes)}",
+            "-p", f"MemoryMax={memory_max_kb}K",
+            f"--uid={os.getuid()}",
+            f"--gid={os.getgid()}",
+            *perf, "bash", "-c", timed_command(job["command"], job["output_dir"]),
+        ]
+        os.makedirs(job["output_dir"], exist_ok=True)
+        print(f"starting job {slot} ({job['name']}) on CPUs {cpus}")
+        running[slot] = {
+            "job": job,
+            "unit": unit,
+            "process": subprocess.Popen(args),
+            "packing": {
+                "slot": slot,
+                "n_jobs": len(jobs),
+                "cpus": cpus,
+                "memory_nodes": nodes,
+                "memory_max_kb": memory_max_kb,
+            },
+            "cgroup": {},
+        }
+
+    failed = []
+    while running:
+        time.sleep(POLL_SECONDS)
+        for slot, state in list(running.items()):
+            # The scope's cgroup disappears when the job exits, so keep the
+            # last sample taken while it was alive.
+            sample = sample_cgroup(state["unit"])
+            if sample["cpu_usage_usec"]:
+                state["cgroup"] = sample
+
+            exit_code = state["process"].poll()
+            if exit_code is None:
+                continue
+            del running[slot]
+            job = state["job"]
+
+            packing = state["packing"]
+            packing["exit_code"] = exit_code
+            packing["cgroup"] = state["cgroup"]
+            packing["perf"] = read_perf_stat(os.path.join(job["output_dir"], "perf-stat.csv"))
+            with open(os.path.join(job["output_dir"], PACKING_FILE), "w") as f:
+                json.dump(packing, f, separators=(",", ":"))
+            print(f"job {slot} ({job['name']}) finished with exit code {exit_code}")
+            if exit_code != 0:
+                failed.append(job["name"])
+
+    # Failed jobs are reported but do not fail the whole instance, the
+    # orchestrator still collects the jobs that succeeded.
+    if failed:
+        print(f"failed jobs: {', '.join(failed)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run several THOR benchmark jobs concurrently in isolated cgroups"
+    )
+    parser.add_argument(
+        "jobs_file",
+        type=str,
+        help="JSON list of jobs, each with a name, an output_dir and a shell command",
+    )
+    args = parser.parse_args()
+
+    with open(args.jobs_file) as f:
+        jobs = json.load(f)
+    run_jobs(jobs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Helpers for the profile-guided optimization training run of oorb.
+
+Run on the benchmark instance by run_benchmark.train_openorb. gcov only
+writes profiles from the process that ran the instrumented code, and it
+writes a .gcda file for every instrumented object on exit whether or not
+its code ran. So the training run must keep THOR in a single process, and
+the profile is only trusted once oorb's propagation code has non-zero
+arc counters.
+"""
+from __future__ import annotations
+
+import argparse
+import glob
+import os
+import subprocess
+import sys
+
+import yaml
+
+# Objects whose code the OD and IOD stages spend their time in.
+PROPAGATION_OBJECTS = ["PropagationInterface"]
+
+
+def single_process(config: dict) -> dict:
+    """
+    Set every num_jobs in a THOR config to 1, and replace the ray backend,
+    which runs its tasks in worker processes even with a single job.
+    """
+    for key, value in config.items():
+        if isinstance(value, dict):
+            single_process(value)
+        elif key == "num_jobs":
+            config[key] = 1
+        elif key == "backend" and value == "ray":
+            config[key] = "cf"
+    return config
+
+
+def arc_counts(gcda_file: str) -> int:
+    """
+    Sum the arc counters recorded in a .gcda file, as listed by gcov-dump:
+
+        file.gcda:    01a10000:  16:COUNTERS arcs 2 counts
+        file.gcda:                   0: 1 100
+    """
+    proc = subprocess.run(["gcov-dump", "-l", gcda_file], stdout=subprocess.PIPE, check=True)
+    total = 0
+    in_arcs = False
+    for line in proc.stdout.decode("utf-8").splitlines():
+        line = line[len(gcda_file) + 1:]
+        if "COUNTERS" in line:
+            in_arcs = "COUNTERS arcs" in line
+        elif in_arcs and ":" in line:
+            total += sum(int(count) for count in line.split(":", 1)[1].split())
+    return total
+
+
+def check_profile(profile_dir: str, objects: list[str]) -> list[str]:
+    """
+    Check that every object was profiled and that its code actually ran.
+    Returns a list of problems.
+    """
+    problems = []
+    gcda_files = glob.glob(os.path.join(profile_dir, "*.gcda"))
+    for name in objects:
+        matching = [path for path in gcda_files if name in os.path.basename(path)]
+        if not matching:
+            problems.append(f"no profile for {name} in {profile_dir}")
+        elif not any(arc_counts(path) for path in matching):
+            problems.append(f"profile for {name} has only zero counters, the training run did not execute it")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Prepare and check the oorb PGO training run"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    config_parser = subparsers.add_parser(
+        "single-process", help="Rewrite a THOR config so that THOR runs in a single process"
+    )
+    config_parser.add_argument("config", type=str, help="THOR config.yaml, rewritten in place")
+
+    check_parser = subparsers.add_parser(
+        "check-profile", help="Fail unless oorb's propagation code was profiled"
+    )
+    check_parser.add_argument("profile_dir", type=str, help="Directory passed to -fprofile-generate")
+    check_parser.add_argument(
+        "--object",
+        type=str,
+        action="append",
+        default=None,
+        dest="objects",
+        help=f"Object that must have non-zero counters (may be repeated, default: {PROPAGATION_OBJECTS})",
+    )
+    args = parser.parse_args()
+
+    if args.command == "single-process":
+        with open(args.config) as f:
+            config = yaml.safe_load(f)
+        with open(args.config, "w") as f:
+            yaml.safe_dump(single_process(config), f)
+        return
+
+    problems = check_profile(args.profile_dir, args.objects or PROPAGATION_OBJECTS)
+    for problem in problems:
+        print(problem, file=sys.stderr)
+    if problems:
+        sys.exit(1)
+    print("profile verified")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,35 @@
 import argparse
 import json
+import os
+import shlex
+import build_variants
 import create_instance
 import ssh_instance
+import run_summary
+import tuning
+import zones
 import random
 import string
+import google.api_core.exceptions
 import google.cloud.storage
 
 PROJECT = "moeyens-thor-dev"
-ZONE = "us-central1-a"
+
+# Where the data and output directories live. "boot" keeps them on the
+# boot disk, the others mount a dedicated scratch volume over them.
+STORAGE_TYPES = ["boot", "pd-ssd", "local-ssd", "tmpfs"]
+SCRATCH_DEVICE_NAME = "thor-scratch"
+SCRATCH_MOUNT = "/mnt/thor-scratch"
+
+# Benchmark inputs and all results live in DATA_BUCKET, in HOME_REGION.
+# Instances in other regions read their inputs from a regional mirror named
+# "{DATA_BUCKET}-{region}" when that bucket exists.
+DATA_BUCKET = "thor-benchmark-data"
+HOME_REGION = "us-central1"
+DATASET_FILES = ["config.yaml", "observations.csv", "orbits.csv"]
+
+# Scripts from this repository that are run on the instance itself.
+REMOTE_SCRIPTS = ["run_summary.py", "fingerprint.py", "packed_run.py", "pgo_training.py"]
 
 
 def parse_args():
@@ -42,6 +64,16 @@ def parse_args():
         required=True,
         help="The username to use for the SSH key",
     )
+    parser.add_argument(
+        "-z",
+        "--zone",
+        type=str,
+        action="append",
+        default=[],
+        dest="zones",
+        help="Candidate zone to launch in (may be repeated). Defaults to the "
+        "configured zones for the machine family, tried in order of past success",
+    )
     parser.add_argument(
         "--no-cleanup",
         action="store_false",
@@ -63,6 +95,81 @@ def parse_args():
         help="Use Intel MKL for linear algebra operations",
     )
 
+    parser.add_argument(
+        "--blas",
+        type=str,
+        choices=list(build_variants.BLAS_BACKENDS),
+        default="default",
+        help="BLAS/LAPACK backend to build numpy against ('default' installs the numpy wheel, or the reference BLAS with --native-comp)",
+    )
+
+    parser.add_argument(
+        "--opt-level",
+        type=str,
+        choices=build_variants.OPT_LEVELS,
+        default=None,
+        dest="opt_level",
+        help="Optimization level for the oorb build (defaults to oorb's own)",
+    )
+
+    parser.add_argument(
+        "--lto",
+        action="store_true",
+        dest="lto",
+        help="Build oorb with link-time optimization",
+    )
+
+    parser.add_argument(
+        "--pgo",
+        action="store_true",
+        dest="pgo",
+        help="Build oorb with profile-guided optimization, trained on --pgo-dataset",
+    )
+
+    parser.add_argument(
+        "--pgo-dataset",
+        type=str,
+        default=None,
+        dest="pgo_dataset",
+        help="Small dataset to train oorb's profile on. Its config should run THOR "
+        "in a single process, since worker processes exit without writing profiles",
+    )
+
+    parser.add_argument(
+        "--storage",
+        type=str,
+        choices=STORAGE_TYPES,
+        default="boot",
+        help="Where to put the input data and THOR output",
+    )
+
+    parser.add_argument(
+        "--scratch-size-gb",
+        type=int,
+        default=100,
+        dest="scratch_size_gb",
+        help="Size of the scratch disk when using --storage=pd-ssd",
+    )
+
+    parser.add_argument(
+        "--pack-dataset",
+        type=str,
+        action="append",
+        default=[],
+        dest="pack_datasets",
+        help="Run this dataset concurrently with --dataset on the same instance, "
+        "each job in its own cpuset and memory cgroup (may be repeated)",
+    )
+
+    parser.add_argument(
+        "--tuning",
+        type=str,
+        action="append",
+        choices=sorted(tuning.PROFILES),
+        default=[],
+        help="Host tuning profile to apply before running THOR (may be repeated)",
+    )
+
     args = parser.parse_args()
     return args
 
@@ -77,8 +184,7 @@ def install_python(ssh):
 
 def apt_repo(zone):
     # eg us-central1-a becomes http://us-central1.gce.archive.ubuntu.com/ubuntu"
-    region, _ = zone.rsplit("-", 1)
-    return "http://{}.gce.archive.ubuntu.com/ubuntu".format(region)
+    return "http://{}.gce.archive.ubuntu.com/ubuntu".format(zones.region(zone))
 
 
 def install_mkl(ssh):
@@ -92,39 +198,53 @@ def install_mkl(ssh):
     )
     ssh.execute_command("sudo apt-get update -y")
     ssh.execute_command("sudo apt-get install -y intel-oneapi-mkl")
+    # Make the MKL libraries visible to the dynamic linker when numpy loads them.
+    ssh.execute_command(
+        "echo /opt/intel/oneapi/mkl/latest/lib/intel64 | sudo tee /etc/ld.so.conf.d/mkl.conf && sudo ldconfig"
+    )
 
 
-def install_numpy(ssh, native_comp=False):
-    if not native_comp:
+def install_numpy(ssh, variant: build_variants.BuildVariant):
+    if not variant.numpy_from_source():
         ssh.execute_command("sudo pip install numpy==1.24")
         return
 
     # Install numpy from source
-    ssh.execute_command("sudo apt-get install -y gfortran liblapack-dev")
+    packages = ["gfortran", "liblapack-dev"] + variant.backend.packages
+    ssh.execute_command(f"sudo apt-get install -y {' '.join(dict.fromkeys(packages))}")
     ssh.execute_command("git clone https://github.com/numpy/numpy.git /opt/numpy")
     ssh.execute_command("sudo pip install cython")
     ssh.execute_command(
         "cd /opt/numpy && git checkout v1.24.4 && git submodule update --init"
     )
+    cpu_baseline = " --cpu-baseline=native" if variant.native else ""
     ssh.execute_command(
-        "cd /opt/numpy && sudo python3 setup.py build --cpu-baseline=native install"
+        f"cd /opt/numpy && {variant.numpy_build_env()}sudo -E python3 setup.py build{cpu_baseline} install"
     )
 
 
-def install_openorb(ssh, native_comp=False):
+def configure_openorb_flags(ssh, flags):
+    if not flags:
+        return
+    # Record the options in the built library so verify_build can check them.
+    flags = flags + ["-frecord-gcc-switches"]
+    # Add the flags to compiler options by running a sed script
+    # directly on the Makefile.include file. This is a hack to get
+    # around the fact that the configure script doesn't support
+    # these options.
+    ssh.execute_command(
+        f"sed -i 's|FCOPTIONS = .*|FCOPTIONS = $(FCOPTIONS_OPT_GFORTRAN) {' '.join(flags)}|g' /opt/oorb/Makefile.include"
+    )
+
+
+def install_openorb(ssh, variant: build_variants.BuildVariant):
     ssh.execute_command("sudo apt-get install -y gfortran liblapack-dev")
     ssh.execute_command("git clone https://github.com/oorb/oorb.git /opt/oorb")
     ssh.execute_command(
         "cd /opt/oorb && ./configure gfortran opt --with-pyoorb --with-f2py=/usr/local/bin/f2py --with-python=python3"
     )
-    if native_comp:
-        # Add '-march=native' to compiler options by running a sed
-        # script directly on the Makefile.includse file. This is a
-        # hack to get around the fact that the configure script
-        # doesn't support this option.
-        ssh.execute_command(
-            "sed -i 's/FCOPTIONS = .*/FCOPTIONS = $(FCOPTIONS_OPT_GFORTRAN) -march=native/g' /opt/oorb/Makefile.include"
-        )
+    # With PGO, start from an instrumented build that train_openorb replaces.
+    configure_openorb_flags(ssh, variant.oorb_flags("generate" if variant.pgo else None))
     ssh.execute_command("sudo pip install -v setuptools wheel")
 
     # --no-build-isolation is needed because we need to ensure we use
@@ -145,30 +265,304 @@ def install_thor(ssh: ssh_instance.SSH, thor_version: str, arm: bool=False):
     ssh.execute_command("cd /opt/thor && sudo pip install -v .")
 
 
+def train_openorb(ssh, variant: build_variants.BuildVariant, dataset: str, bucket: str):
+    # Run THOR on a small dataset with the instrumented oorb, then rebuild
+    # oorb using the recorded profile.
+    # Start from an empty profile, building the ephemerides ran
+    # instrumented oorb code too.
+    ssh.execute_command(
+        f"sudo rm -rf {build_variants.PGO_PROFILE_DIR} && mkdir -p {build_variants.PGO_PROFILE_DIR} "
+        f"&& chmod 777 {build_variants.PGO_PROFILE_DIR}"
+    )
+    load_dataset(ssh, dataset, bucket, data_dir="/opt/thor-pgo-data")
+    # Worker processes exit without writing their profiles, so train with
+    # THOR in a single process.
+    ssh.execute_command("python3 /opt/thor-bench/pgo_training.py single-process /opt/thor-pgo-data/config.yaml")
+    ssh.execute_command(
+        "export OORB_DATA=/opt/oorb/data && " + thor_command("/opt/thor-pgo-data", "/opt/thor-pgo-output")
+    )
+    ssh.execute_command(f"python3 /opt/thor-bench/pgo_training.py check-profile {build_variants.PGO_PROFILE_DIR}")
+
+    ssh.execute_command("cd /opt/oorb && sudo make clean")
+    configure_openorb_flags(ssh, variant.oorb_flags("use"))
+    ssh.execute_command(
+        "sudo pip install --no-build-isolation --force-reinstall --no-deps -v /opt/oorb"
+    )
+    ssh.execute_command("cd /opt/oorb && sudo make ephem")
+
+
+def verify_build(ssh, variant: build_variants.BuildVariant):
+    # Fail the run rather than benchmark a build that silently fell back
+    # to a different BLAS or different compiler options.
+    expectations = [f"--expect-blas={variant.backend.library_marker}"] + [
+        f"--expect-oorb-flag={flag}"
+        for flag in variant.oorb_flags("use" if variant.pgo else None)
+    ]
+    ssh.execute_command(
+        f"cd /opt/thor-bench && python3 fingerprint.py {' '.join(shlex.quote(e) for e in expectations)}"
+    )
+    ssh.execute_command("cd /opt/thor-bench && python3 -c 'import pyoorb'")
+
+
+def thor_command(data_dir, output_dir):
+    return f"python3 /opt/thor/runTHOR.py --config {data_dir}/config.yaml {data_dir}/observations.csv {data_dir}/orbits.csv {output_dir}/thor/"
+
+
 def enable_sysstat(ssh, interval_seconds=1, count=60):
     ssh.execute_command("sudo apt-get install -y sysstat")
     ssh.execute_command("echo 'ENABLED=\"true\"' | sudo tee /etc/default/sysstat")
+    # Collect per-device I/O statistics as well.
+    ssh.execute_command(
+        "sudo sed -i 's/^SADC_OPTIONS=.*/SADC_OPTIONS=\"-S DISK\"/' /etc/sysstat/sysstat"
+    )
     ssh.execute_command(
         "echo '* * * * * root /usr/lib/sysstat/sa1 10 6' | sudo tee /etc/cron.d/sysstat"
     )
     ssh.execute_command("sudo systemctl restart sysstat")
 
 
-def load_dataset(ssh, dataset):
-    ssh.execute_command("mkdir /opt/thor-data /opt/thor-output")
+def scratch_disks(storage, zone, size_gb):
+    if storage == "pd-ssd":
+        return [
+            create_instance.empty_disk(
+                disk_type=f"zones/{zone}/diskTypes/pd-ssd",
+                disk_size_gb=size_gb,
+                device_name=SCRATCH_DEVICE_NAME,
+            )
+        ]
+    if storage == "local-ssd":
+        return [create_instance.local_ssd_disk(zone)]
+    return []
+
+
+def prepare_storage(ssh, storage):
+    if storage == "boot":
+        ssh.execute_command("mkdir -p /opt/thor-data /opt/thor-output")
+        return
+
+    ssh.execute_command(f"sudo mkdir -p {SCRATCH_MOUNT}")
+    if storage == "tmpfs":
+        ssh.execute_command(f"sudo mount -t tmpfs -o size=50% tmpfs {SCRATCH_MOUNT}")
+    else:
+        if storage == "pd-ssd":
+            device = f"/dev/disk/by-id/google-{SCRATCH_DEVICE_NAME}"
+        else:
+            device = "/dev/disk/by-id/google-local-nvme-ssd-0"
+        ssh.execute_command(
+            f"sudo mkfs.ext4 -F -m 0 -E lazy_itable_init=0,lazy_journal_init=0,discard {device}"
+        )
+        ssh.execute_command(f"sudo mount -o discard,defaults,noatime {device} {SCRATCH_MOUNT}")
+
+    # Bind mount rather than symlink so every /opt path stays valid for
+    # THOR, gsutil and the run summary.
+    for directory in ["thor-data", "thor-output"]:
+        ssh.execute_command(
+            f"sudo mkdir -p {SCRATCH_MOUNT}/{directory} /opt/{directory} && sudo chmod 777 {SCRATCH_MOUNT}/{directory}"
+        )
+        ssh.execute_command(f"sudo mount --bind {SCRATCH_MOUNT}/{directory} /opt/{directory}")
+    ssh.execute_command("df -h /opt/thor-data /opt/thor-output")
+
+
+def data_bucket(zone, datasets):
+    """
+    Pick the bucket the instance downloads its inputs from, mirroring the
+    datasets into the regional bucket first if they are not there yet.
+    """
+    if zones.region(zone) == HOME_REGION:
+        return DATA_BUCKET
+
+    client = google.cloud.storage.Client()
+    bucket_name = f"{DATA_BUCKET}-{zones.region(zone)}"
+    try:
+        regional = client.get_bucket(bucket_name)
+    except google.api_core.exceptions.NotFound:
+        print(f"no regional bucket {bucket_name}, reading inputs from {DATA_BUCKET}")
+        return DATA_BUCKET
+
+    source = client.bucket(DATA_BUCKET)
+    for dataset in datasets:
+        for filename in DATASET_FILES:
+            blob = regional.blob(f"{dataset}/{filename}")
+            if blob.exists():
+                continue
+            print(f"staging {dataset}/{filename} in {bucket_name}")
+            # Rewrite in chunks, large files don't finish in a single call.
+            token, _, _ = blob.rewrite(source.blob(f"{dataset}/{filename}"))
+            while token is not None:
+                token, _, _ = blob.rewrite(source.blob(f"{dataset}/{filename}"), token=token)
+    return bucket_name
+
+
+def load_dataset(ssh, dataset, bucket=DATA_BUCKET, data_dir="/opt/thor-data"):
+    ssh.execute_command(f"mkdir -p {data_dir}")
+    for filename in DATASET_FILES:
+        ssh.execute_command(
+            f"gsutil cp gs://{bucket}/{dataset}/{filename} {data_dir}/{filename}"
+        )
+
+
+def upload_scripts(ssh):
+    ssh.execute_command("mkdir -p /opt/thor-bench")
+    for script in REMOTE_SCRIPTS:
+        ssh.copy_file(
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), script),
+            f"/opt/thor-bench/{script}",
+        )
+
+
+def summarize_run(ssh, output_dir="/opt/thor-output", data_dir="/opt/thor-data"):
+    # Build the run manifest on the instance, so analysis only needs to
+    # fetch one object per run.
+    ssh.execute_command(
+        f"python3 /opt/thor-bench/run_summary.py {output_dir} --data-dir {data_dir}"
+    )
+
+
+def publish_results(ssh, params, run_name, output_dir="/opt/thor-output", data_dir="/opt/thor-data"):
+    dataset = params["dataset"]
+
+    # Collect system resource data
+    ssh.execute_command(f"sudo cp /var/log/sysstat/sa* {output_dir}/")
+    ssh.execute_command(f"sudo chmod a+r {output_dir}/sa*")
     ssh.execute_command(
-        f"gsutil cp gs://thor-benchmark-data/{dataset}/config.yaml /opt/thor-data/config.yaml"
+        f"echo {shlex.quote(json.dumps(params))} > {output_dir}/{run_summary.PARAMETERS_FILE}"
     )
+
+    # Copy output to GCS
     ssh.execute_command(
-        f"gsutil cp gs://thor-benchmark-data/{dataset}/observations.csv /opt/thor-data/observations.csv"
+        f"gsutil cp -r {output_dir}/* gs://{DATA_BUCKET}/{dataset}/results/{run_name}/thor-output/"
+    )
+
+    google.cloud.storage.Client().bucket(DATA_BUCKET).blob(
+        f"{dataset}/results/{run_name}/benchmark-parameters.json"
+    ).upload_from_string(json.dumps(params))
+
+    # Summarize the run into a single manifest. The raw output is already
+    # uploaded and analyze_results falls back to it when there is no
+    # manifest, so a failure here must not lose the run.
+    try:
+        summarize_run(ssh, output_dir, data_dir)
+        ssh.execute_command(
+            f"gsutil cp {output_dir}/{run_summary.MANIFEST_FILE} gs://{DATA_BUCKET}/{dataset}/results/{run_name}/{run_summary.MANIFEST_FILE}"
+        )
+    except Exception as e:
+        print(f"could not build the run manifest for {run_name}: {e}")
+
+    print(f"results are in gs://{DATA_BUCKET}/{dataset}/results/{run_name}")
+    print(
+        f"download command: \n\tgsutil cp -r gs://{DATA_BUCKET}/{dataset}/results/{run_name}/ ."
     )
+
+
+def run_dedicated(ssh, args, name, tuning_profiles):
+    load_dataset(ssh, args.dataset, args.data_bucket)
+
+    # Note the time
+    ssh.execute_command("date > /opt/thor-output/start_time.txt")
+
+    # Run THOR
     ssh.execute_command(
-        f"gsutil cp gs://thor-benchmark-data/{dataset}/orbits.csv /opt/thor-data/orbits.csv"
+        "export OORB_DATA=/opt/oorb/data && "
+        + tuning.wrap_command(tuning_profiles, thor_command("/opt/thor-data", "/opt/thor-output"))
     )
 
+    # Note the time
+    ssh.execute_command("date > /opt/thor-output/end_time.txt")
+
+    publish_results(ssh, vars(args), name)
+
+
+def run_packed(ssh, args, name, tuning_profiles):
+    # One job per dataset, each with its own data and output directory on
+    # the selected storage.
+    jobs = []
+    for slot, dataset in enumerate([args.dataset] + args.pack_datasets):
+        data_dir = f"/opt/thor-data/job-{slot}"
+        output_dir = f"/opt/thor-output/job-{slot}"
+        load_dataset(ssh, dataset, args.data_bucket, data_dir=data_dir)
+        jobs.append({
+            "name": f"{name}p{slot}",
+            "dataset": dataset,
+            "data_dir": data_dir,
+            "output_dir": output_dir,
+            "command": "export OORB_DATA=/opt/oorb/data && "
+            + tuning.wrap_command(tuning_profiles, thor_command(data_dir, output_dir)),
+        })
+
+    # perf is used to measure instructions per cycle of each job, where the
+    # instance exposes hardware counters.
+    ssh.execute_command("sudo apt-get install -y linux-tools-common linux-tools-$(uname -r) || true")
+    ssh.execute_command("sudo sysctl -w kernel.perf_event_paranoid=1")
+
+    ssh.execute_command(f"echo {shlex.quote(json.dumps(jobs))} > /opt/thor-bench/jobs.json")
+    ssh.execute_command("cd /opt/thor-bench && python3 packed_run.py jobs.json")
+
+    for slot, job in enumerate(jobs):
+        params = dict(vars(args), dataset=job["dataset"], pack_jobs=len(jobs), pack_slot=slot)
+        try:
+            publish_results(ssh, params, job["name"], job["output_dir"], job["data_dir"])
+        except Exception as e:
+            print(f"could not collect results for {job['name']}: {e}")
+
+
+def instance_disks(args, image, zone):
+    return [
+        create_instance.disk_from_image(
+            disk_type=f"zones/{zone}/diskTypes/pd-balanced",
+            disk_size_gb=100,
+            boot=True,
+            source_image=image,
+        ),
+    ] + scratch_disks(args.storage, zone, args.scratch_size_gb)
+
+
+def launch_instance(args, name, image):
+    """
+    Create the instance in the first candidate zone that has capacity,
+    failing over to the next zone on capacity or quota errors. Returns the
+    zone the instance was created in.
+    """
+    cache = zones.ZoneAvailabilityCache()
+    candidates = cache.order(args.instance, args.zones or zones.candidate_zones(args.instance))
+    if not candidates:
+        raise ValueError(f"No candidate zones offer {args.instance}")
+
+    for zone in candidates:
+        try:
+            create_instance.create_instance(
+                project_id=PROJECT,
+                zone=zone,
+                instance_name=name,
+                service_account=create_instance.service_account(
+                    "thor-benchmarker@moeyens-thor-dev.iam.gserviceaccount.com",
+                    ["https://www.googleapis.com/auth/cloud-platform"],
+                ),
+                disks=instance_disks(args, image, zone),
+                external_access=True,
+                machine_type=args.instance,
+            )
+        except create_instance.CapacityError as e:
+            print(f"unable to create instance, trying the next zone: {e}")
+            cache.record(args.instance, zone, e.code)
+            continue
+        cache.record(args.instance, zone, "ok")
+        return zone
+
+    raise RuntimeError(f"No capacity for {args.instance} in any of {candidates}")
+
 
 def main():
     args = parse_args()
+    tuning_profiles = tuning.resolve_profiles(args.tuning)
+    # Record the profiles in the order they are applied.
+    args.tuning = [profile.name for profile in tuning_profiles]
+    if args.pack_datasets:
+        unpackable = [profile.name for profile in tuning_profiles if not profile.packable]
+        if unpackable:
+            raise ValueError(f"Tuning profiles {unpackable} cannot be combined with --pack-dataset")
+    variant = build_variants.BuildVariant.from_args(args)
+    args.blas = variant.blas
+    args.build_variant = variant.name()
 
     name = f"benchmark-thor-{args.instance}-{args.thor_version[:6]}-{rand_str(4)}"
 
@@ -179,33 +573,21 @@ def main():
         # x86
         image = "projects/ubuntu-os-cloud/global/images/ubuntu-2204-jammy-v20230616"
 
-    instance = create_instance.create_instance(
-        project_id=PROJECT,
-        zone=ZONE,
-        instance_name=name,
-        service_account=create_instance.service_account(
-            "thor-benchmarker@moeyens-thor-dev.iam.gserviceaccount.com",
-            ["https://www.googleapis.com/auth/cloud-platform"],
-        ),
-        disks=[
-            create_instance.disk_from_image(
-                disk_type=f"zones/{ZONE}/diskTypes/pd-balanced",
-                disk_size_gb=100,
-                boot=True,
-                source_image=image,
-            ),
-        ],
-        external_access=True,
-        machine_type=args.instance,
-    )
+    zone = launch_instance(args, name, image)
+    args.zone = zone
     try:
         print("connecting to instance")
-        ssh = ssh_instance.SSH(PROJECT, name, ZONE)
+        ssh = ssh_instance.SSH(PROJECT, name, zone)
         ssh.wait_for_connection()
 
+        # Read inputs from a bucket in the instance's region
+        args.data_bucket = data_bucket(
+            zone, [args.dataset] + args.pack_datasets + ([args.pgo_dataset] if variant.pgo else [])
+        )
+
         # Install system dependencies
         if not args.instance.startswith("t2a"):
-            ssh.execute_command(f"sudo add-apt-repository -y {apt_repo(ZONE)}",)
+            ssh.execute_command(f"sudo add-apt-repository -y {apt_repo(zone)}",)
         else:
             # ARM
             pass
@@ -214,51 +596,36 @@ def main():
         ssh.execute_command("sudo chmod 777 /opt")
 
         install_python(ssh)
-        if args.use_mkl:
+        upload_scripts(ssh)
+        if variant.blas == "mkl":
             install_mkl(ssh)
-        install_numpy(ssh, native_comp=args.native_comp)
-        install_openorb(ssh, native_comp=args.native_comp)
+        install_numpy(ssh, variant)
+        install_openorb(ssh, variant)
         install_thor(ssh, args.thor_version, arm=args.instance.startswith("t2a"))
+        if variant.pgo:
+            train_openorb(ssh, variant, args.pgo_dataset, args.data_bucket)
+        verify_build(ssh, variant)
 
         enable_sysstat(ssh)
 
-        # Download data
-        load_dataset(ssh, args.dataset)
-
-        # Note the time
-        ssh.execute_command("date > /opt/thor-output/start_time.txt")
+        # Prepare the data and output directories
+        prepare_storage(ssh, args.storage)
 
-        # Run THOR
-        ssh.execute_command(
-            "export OORB_DATA=/opt/oorb/data && python3 /opt/thor/runTHOR.py --config /opt/thor-data/config.yaml /opt/thor-data/observations.csv /opt/thor-data/orbits.csv /opt/thor-output/thor/"
-        )
+        # Tune the host
+        tuning.apply_profiles(ssh, tuning_profiles)
 
-        # Note the time
-        ssh.execute_command("date > /opt/thor-output/end_time.txt")
-
-        # Collect system resource data
-        ssh.execute_command("sudo cp /var/log/sysstat/sa* /opt/thor-output/")
-
-        # Copy output to GCS
-        ssh.execute_command(
-            f"gsutil cp -r /opt/thor-output gs://thor-benchmark-data/{args.dataset}/results/{name}/"
-        )
-
-        google.cloud.storage.Client().bucket("thor-benchmark-data").blob(
-            f"{args.dataset}/results/{name}/benchmark-parameters.json"
-        ).upload_from_string(json.dumps(vars(args)))
+        if args.pack_datasets:
+            run_packed(ssh, args, name, tuning_profiles)
+        else:
+            run_dedicated(ssh, args, name, tuning_profiles)
 
         print("all done!")
-        print(f"results are in gs://thor-benchmark-data/{args.dataset}/results/{name}")
-        print(
-            f"download command: \n\tgsutil cp -r gs://thor-benchmark-data/{args.dataset}/results/{name}/ ."
-        )
 
     except Exception as e:
         print(e)
     finally:
         if args.cleanup:
-            create_instance.delete_instance(PROJECT, ZONE, name)
+            create_instance.delete_instance(PROJECT, zone, name)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,404 @@
+"""
+Summarize a finished benchmark run into a single manifest.
+
+This script is copied onto the benchmark instance and run there once THOR
+has finished, so that everything analyze_results needs about a run ends up
+in one small, self-describing JSON object next to the raw output. It only
+depends on the standard library (plus pyyaml, which THOR installs).
+"""
+from __future__ import annotations
+
+import argparse
+import dataclasses
+import datetime
+import json
+import os
+import re
+import subprocess
+
+from fingerprint import Fingerprint
+
+# 2: added "fingerprint"
+# 3: added "io"
+# 4: added host tuning state to "fingerprint"
+# 5: added "packing"
+MANIFEST_VERSION = 5
+MANIFEST_FILE = "manifest.json"
+PARAMETERS_FILE = "benchmark-parameters.json"
+# Written by packed_run.py for jobs that shared the instance.
+PACKING_FILE = "packing.json"
+
+# format: 'Thu Jun 29 05:58:38 UTC 2023'
+DATE_FORMAT = "%a %b %d %H:%M:%S %Z %Y"
+
+
+# Log lines reporting how long each THOR stage took. OD and attribution run
+# once per iteration, so their lines appear several times.
+STAGE_REGEXES = {
+    "range_and_shift": re.compile(r'Range and shift completed in (\d+\.\d+) seconds.'),
+    "clustering": re.compile(r'Clustering and restructuring completed in (\d+\.\d+) seconds.'),
+    "iod": re.compile(r'Initial orbit determination completed in (\d+\.\d+) seconds.'),
+    "od": re.compile(r'Differential correction completed in (\d+\.\d+) seconds.'),
+    "attribution": re.compile(r'Attribution completed in (\d+\.\d+) seconds.'),
+    "merging": re.compile(r'Orbit extension and merging completed in (\d+\.\d+) seconds.'),
+}
+
+
+@dataclasses.dataclass
+class THORLogOutput:
+    n_obs: int
+    n_clusters: int
+    n_initial_orbits: int
+    n_orbits: int
+    n_merged_orbits: int
+    n_od_iterations: int
+
+    range_and_shift_time: float
+    clustering_time: float
+    iod_time: float
+    total_od_time: float
+    total_attribution_time: float
+    merging_time: float
+
+    @classmethod
+    def from_lines(cls, lines: list[str]):
+        # 2023-06-28 14:11:42.684 [INFO] [140025143456192] Found 11153 observations. (main.py, rangeAndShift, 385)'
+        # 2023-06-28 14:11:42.684 [INFO] [140025143456192] Range and shift completed in 28.289 seconds. (main.py, rangeAndShift, 386)
+        # 2023-06-28 14:12:47.288 [INFO] [140025143456192] Found 1405 clusters. (main.py, clusterAndLink, 719)
+        # 2023-06-28 14:12:47.288 [INFO] [140025143456192] Clustering and restructuring completed in 63.647 seconds. (main.py, clusterAndLink, 720)
+        # 2023-06-28 14:12:51.176 [INFO] [140025143456192] Found 471 initial orbits. (iod.py, initialOrbitDetermination, 795)
+        # 2023-06-28 14:12:51.201 [INFO] [140025143456192] Initial orbit determination completed in 3.889 seconds. (iod.py, initialOrbitDetermination, 812)
+        # 2023-06-28 14:13:20.989 [INFO] [140025143456192] Differential correction completed in 29.712 seconds. (od.py, differentialCorrection, 801)
+        # 2023-06-28 14:13:21.908 [INFO] [140025143456192] Attribution completed in 0.855 seconds. (attribution.py, attributeObservations, 302)
+        # 2023-06-28 14:13:22.617 [INFO] [140025143456192] Differential correction completed in 0.600 seconds. (od.py, differentialCorrection, 801)
+        # 2023-06-28 14:13:23.467 [INFO] [140025143456192] Attribution completed in 0.794 seconds. (attribution.py, attributeObservations, 302)'
+        # 2023-06-28 14:13:28.351 [INFO] [140025143456192] Number of attribution / differential correction iterations: 5 (attribution.py, mergeAndExtendOrbits, 529)
+        # 2023-06-28 14:13:28.351 [INFO] [140025143456192] Extended and/or merged 9 orbits into 9 orbits. (attribution.py, mergeAndExtendOrbits, 534)
+        # 2023-06-28 14:13:28.351 [INFO] [140025143456192] Orbit extension and merging completed in 7.311 seconds. (attribution.py, mergeAndExtendOrbits, 539)
+
+        n_obs_regex = re.compile(r'Found (\d+) observations.')
+        n_clusters_regex = re.compile(r'Found (\d+) clusters.')
+        n_initial_orbits_regex = re.compile(r'Found (\d+) initial orbits.')
+        n_orbits_regex = re.compile(r'Extended and/or merged (\d+) orbits into (\d+) orbits.')
+        n_od_iterations_regex = re.compile(r'Number of attribution / differential correction iterations: (\d+)')
+
+        range_and_shift_regex = STAGE_REGEXES["range_and_shift"]
+        clustering_regex = STAGE_REGEXES["clustering"]
+        iod_regex = STAGE_REGEXES["iod"]
+        od_regex = STAGE_REGEXES["od"]
+        attribution_regex = STAGE_REGEXES["attribution"]
+        merging_regex = STAGE_REGEXES["merging"]
+
+        matches = {
+            "total_od_time": 0,
+            "total_attribution_time": 0,
+        }
+        for line in lines:
+            if n_obs_regex.search(line):
+                matches['n_obs'] = int(n_obs_regex.search(line).group(1))
+            elif n_clusters_regex.search(line):
+                matches['n_clusters'] = int(n_clusters_regex.search(line).group(1))
+            elif n_initial_orbits_regex.search(line):
+                matches['n_initial_orbits'] = int(n_initial_orbits_regex.search(line).group(1))
+            elif n_orbits_regex.search(line):
+                matches['n_orbits'] = int(n_orbits_regex.search(line).group(1))
+                matches['n_merged_orbits'] = int(n_orbits_regex.search(line).group(2))
+            elif n_od_iterations_regex.search(line):
+                matches['n_od_iterations'] = int(n_od_iterations_regex.search(line).group(1)) or 1
+            elif range_and_shift_regex.search(line):
+                matches['range_and_shift_time'] = float(range_and_shift_regex.search(line).group(1))
+            elif clustering_regex.search(line):
+                matches['clustering_time'] = float(clustering_regex.search(line).group(1))
+            elif iod_regex.search(line):
+                matches['iod_time'] = float(iod_regex.search(line).group(1))
+            elif od_regex.search(line):
+                matches['total_od_time'] += float(od_regex.search(line).group(1))
+            elif attribution_regex.search(line):
+                matches['total_attribution_time'] += float(attribution_regex.search(line).group(1))
+            elif merging_regex.search(line):
+                matches['merging_time'] = float(merging_regex.search(line).group(1))
+
+        return cls(**matches)
+
+
+@dataclasses.dataclass
+class THORConfig:
+    cell_area: float
+    backend: str
+    cluster_min_obs: int
+    cluster_algorithm: str
+
+    @classmethod
+    def from_dict(cls, config: dict):
+        return cls(
+            cell_area=config["RANGE_SHIFT_CONFIG"]["cell_area"],
+            backend=config["RANGE_SHIFT_CONFIG"]["backend"],
+            cluster_min_obs=config["CLUSTER_LINK_CONFIG"]["min_obs"],
+            cluster_algorithm=config["CLUSTER_LINK_CONFIG"]["alg"],
+        )
+
+
+def parse_date(date_str: str) -> datetime.datetime:
+    return datetime.datetime.strptime(date_str.strip(), DATE_FORMAT)
+
+
+def sample_time(stat: dict) -> datetime.datetime:
+    # sadf reports the end of each sampling interval, in UTC.
+    return datetime.datetime.strptime(
+        f"{stat['timestamp']['date']} {stat['timestamp']['time']}", "%Y-%m-%d %H:%M:%S"
+    )
+
+
+def samples_between(statistics: list[dict], start: datetime.datetime, end: datetime.datetime) -> list[dict]:
+    return [stat for stat in statistics if start <= sample_time(stat) <= end]
+
+
+def mean(samples: list[dict], key: str) -> float:
+    if not samples:
+        return 0.0
+    return round(sum(s.get(key, 0.0) for s in samples) / len(samples), 2)
+
+
+def all_cpu(stat: dict) -> list[dict]:
+    return [cpu for cpu in stat.get("cpu-load", []) if cpu["cpu"] == "all"]
+
+
+@dataclasses.dataclass
+class ResourceStats:
+    n_samples: int
+    mean_cpu_user: float
+    mean_cpu_system: float
+    mean_cpu_iowait: float
+    mean_cpu_steal: float
+    max_cpu_busy: float
+    max_memory_used_kb: int
+    max_memory_used_percent: float
+
+    @classmethod
+    def from_sadf(cls, statistics: list[dict], start: datetime.datetime, end: datetime.datetime):
+        """
+        Summarize the CPU and memory samples of `sadf -j -- -u -r` output
+        that fall within the THOR run.
+        """
+        cpu_samples = []
+        memory_samples = []
+        for stat in samples_between(statistics, start, end):
+            cpu_samples.extend(all_cpu(stat))
+            if "memory" in stat:
+                memory_samples.append(stat["memory"])
+
+        return cls(
+            n_samples=len(cpu_samples),
+            mean_cpu_user=mean(cpu_samples, "user"),
+            mean_cpu_system=mean(cpu_samples, "system"),
+            mean_cpu_iowait=mean(cpu_samples, "iowait"),
+            mean_cpu_steal=mean(cpu_samples, "steal"),
+            max_cpu_busy=max((100.0 - s["idle"] for s in cpu_samples), default=0.0),
+            max_memory_used_kb=max((s["memused"] for s in memory_samples), default=0),
+            max_memory_used_percent=max((s["memused-percent"] for s in memory_samples), default=0.0),
+        )
+
+
+@dataclasses.dataclass
+class DeviceIOStats:
+    device: str
+    n_samples: int
+    read_kb: float
+    write_kb: float
+    mean_util: float
+    max_util: float
+    max_await_ms: float
+
+
+@dataclasses.dataclass
+class StageIOStats:
+    stage: str
+    duration: float
+    n_samples: int
+    mean_cpu_iowait: float
+    read_kb: float
+    write_kb: float
+
+
+def transferred_kb(stat: dict, key: str) -> float:
+    # Disk rates are per second, averaged over the sampling interval.
+    return sum(disk.get(key, 0.0) for disk in stat.get("disk", [])) * stat["timestamp"].get("interval", 0)
+
+
+def device_io_stats(statistics: list[dict], start: datetime.datetime, end: datetime.datetime) -> list[DeviceIOStats]:
+    """
+    Summarize the per-device samples of `sadf -j -- -d -p` output that fall
+    within the THOR run.
+    """
+    per_device = {}
+    for stat in samples_between(statistics, start, end):
+        interval = stat["timestamp"].get("interval", 0)
+        for disk in stat.get("disk", []):
+            per_device.setdefault(disk["disk-device"], []).append(dict(disk, interval=interval))
+
+    return [
+        DeviceIOStats(
+            device=device,
+            n_samples=len(samples),
+            read_kb=round(sum(s.get("rkB", 0.0) * s["interval"] for s in samples), 1),
+            write_kb=round(sum(s.get("wkB", 0.0) * s["interval"] for s in samples), 1),
+            mean_util=mean(samples, "util"),
+            max_util=max(s.get("util", 0.0) for s in samples),
+            max_await_ms=max(s.get("await", 0.0) for s in samples),
+        )
+        for device, samples in sorted(per_device.items())
+    ]
+
+
+def stage_windows(lines: list[str]) -> list[tuple[str, datetime.datetime, datetime.datetime]]:
+    """
+    Recover the wall-clock window of every stage from the timestamp of its
+    'completed in N seconds' log line.
+    """
+    windows = []
+    for line in lines:
+        for stage, regex in STAGE_REGEXES.items():
+            match = regex.search(line)
+            if match:
+                # 2023-06-28 14:11:42.684 [INFO] ...
+                end = datetime.datetime.strptime(line[:23], "%Y-%m-%d %H:%M:%S.%f")
+                start = end - datetime.timedelta(seconds=float(match.group(1)))
+                windows.append((stage, start, end))
+                break
+    return windows
+
+
+def stage_io_stats(statistics: list[dict], windows: list[tuple[str, datetime.datetime, datetime.datetime]]) -> list[StageIOStats]:
+    """
+    Attribute CPU iowait and disk traffic to the THOR stages. Samples are
+    only taken every 10 seconds, so stages shorter than that may have none.
+    OD and attribution run several times and are aggregated per stage.
+    """
+    per_stage = {}
+    for stage, start, end in windows:
+        duration, samples = per_stage.get(stage, (0.0, []))
+        per_stage[stage] = (duration + (end - start).total_seconds(), samples + samples_between(statistics, start, end))
+
+    stage_stats = []
+    for stage, (duration, samples) in per_stage.items():
+        cpu_samples = [cpu for stat in samples for cpu in all_cpu(stat)]
+        stage_stats.append(StageIOStats(
+            stage=stage,
+            duration=round(duration, 3),
+            n_samples=len(samples),
+            mean_cpu_iowait=mean(cpu_samples, "iowait"),
+            read_kb=round(sum(transferred_kb(stat, "rkB") for stat in samples), 1),
+            write_kb=round(sum(transferred_kb(stat, "wkB") for stat in samples), 1),
+        ))
+    return stage_stats
+
+
+def mount_source(path: str) -> str:
+    # eg '/dev/nvme0n1 ext4' or 'tmpfs tmpfs'
+    proc = subprocess.run(
+        ["findmnt", "-n", "-o", "SOURCE,FSTYPE", "--target", path],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    return " ".join(proc.stdout.decode("utf-8").split())
+
+
+def sysstat_files(output_dir: str) -> list[str]:
+    # Only the binary daily files (saDD), not the text reports (sarDD).
+    return sorted(
+        os.path.join(output_dir, f) for f in os.listdir(output_dir) if re.match(r"^sa\d+$", f)
+    )
+
+
+def load_sadf_statistics(sa_file: str, *sar_args: str) -> list[dict]:
+    proc = subprocess.run(
+        ["sadf", "-j", sa_file, "--", *sar_args],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    if proc.returncode != 0:
+        print(f"sadf failed for {sa_file}: {proc.stderr.decode('utf-8')}")
+        return []
+    statistics = []
+    for host in json.loads(proc.stdout)["sysstat"]["hosts"]:
+        statistics.extend(host["statistics"])
+    return statistics
+
+
+def collect_statistics(output_dir: str) -> list[dict]:
+    statistics = []
+    for sa_file in sysstat_files(output_dir):
+        statistics.extend(load_sadf_statistics(sa_file, "-u", "-r", "-d", "-p"))
+    return statistics
+
+
+def build_manifest(output_dir: str, data_dir: str) -> dict:
+    import yaml
+
+    with open(os.path.join(output_dir, PARAMETERS_FILE)) as f:
+        parameters = json.load(f)
+
+    with open(os.path.join(output_dir, "start_time.txt")) as f:
+        start_time = parse_date(f.read())
+    with open(os.path.join(output_dir, "end_time.txt")) as f:
+        end_time = parse_date(f.read())
+
+    with open(os.path.join(output_dir, "thor", "orbit_00000000", "thor.log")) as f:
+        log_lines = f.read().split("\n")
+    log_output = THORLogOutput.from_lines(log_lines)
+
+    with open(os.path.join(output_dir, "thor", "config.yml")) as f:
+        thor_config = THORConfig.from_dict(yaml.safe_load(f))
+
+    statistics = collect_statistics(output_dir)
+
+    packing = None
+    if os.path.exists(os.path.join(output_dir, PACKING_FILE)):
+        with open(os.path.join(output_dir, PACKING_FILE)) as f:
+            packing = json.load(f)
+
+    return {
+        "version": MANIFEST_VERSION,
+        "parameters": parameters,
+        "log": dataclasses.asdict(log_output),
+        "config": dataclasses.asdict(thor_config),
+        "timing": {
+            "start_time": start_time.isoformat(),
+            "end_time": end_time.isoformat(),
+            "execution_time": (end_time - start_time).total_seconds(),
+        },
+        "resources": dataclasses.asdict(ResourceStats.from_sadf(statistics, start_time, end_time)),
+        "fingerprint": Fingerprint.collect().to_dict(),
+        "io": {
+            "data_source": mount_source(data_dir),
+            "output_source": mount_source(output_dir),
+            "devices": [dataclasses.asdict(d) for d in device_io_stats(statistics, start_time, end_time)],
+            "stages": [dataclasses.asdict(s) for s in stage_io_stats(statistics, stage_windows(log_lines))],
+        },
+        "packing": packing,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Summarize a THOR benchmark run into a single manifest"
+    )
+    parser.add_argument(
+        "output_dir", type=str, help="The benchmark output directory on the instance"
+    )
+    parser.add_argument(
+        "--data-dir",
+        type=str,
+        default="/opt/thor-data",
+        help="The benchmark input directory on the instance",
+    )
+    args = parser.parse_args()
+
+    manifest = build_manifest(args.output_dir, args.data_dir)
+    with open(os.path.join(args.output_dir, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, separators=(",", ":"))
+    print(f"wrote {MANIFEST_FILE} (version {MANIFEST_VERSION})")
+
+
+if __name__ == "__main__":
+    main()
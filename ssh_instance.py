@@ -21,6 +21,19 @@ class SSH:
         if proc.returncode != 0:
             raise Exception(f"Error while executing command.")
 
+    def copy_file(self, local_path, remote_path):
+        args = [
+            "gcloud", "compute", "scp",
+            f"--project={self.project}",
+            f"--zone={self.zone}",
+            local_path,
+            f"{self.instance}:{remote_path}"
+        ]
+        print(f"running command: {' '.join(args)}")
+        proc = subprocess.run(args, stdout=sys.stdout, stderr=sys.stderr, stdin=sys.stdin)
+        if proc.returncode != 0:
+            raise Exception(f"Error while copying {local_path} to instance.")
+
     def wait_for_connection(self):
         print("attempting ssh connection...")
         args = [
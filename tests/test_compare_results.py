@@ -0,0 +1,121 @@
+import argparse
+import math
+import random
+
+import pytest
+
+pytest.importorskip("google.cloud.storage")
+
+import compare_results
+from analyze_results import BenchmarkParameters, OutputLine
+from compare_results import Change
+from run_summary import THORConfig, THORLogOutput
+
+BASELINE = "aaaaaaaa11111111"
+CANDIDATE = "bbbbbbbb22222222"
+
+
+def output_line(rng, thor_version, dataset, iod_scale=1.0):
+    # Every stage takes around 100 seconds, give or take 1%.
+    def jitter(value):
+        return value * rng.uniform(0.99, 1.01)
+
+    params = BenchmarkParameters.from_dict({
+        "instance": "c2-standard-8",
+        "thor_version": thor_version,
+        "dataset": dataset,
+        "native_comp": False,
+        "use_mkl": False,
+    })
+    log_output = THORLogOutput(
+        n_obs=1000,
+        n_clusters=100,
+        n_initial_orbits=10,
+        n_orbits=5,
+        n_merged_orbits=5,
+        n_od_iterations=1,
+        range_and_shift_time=jitter(100.0),
+        clustering_time=jitter(100.0),
+        iod_time=jitter(100.0 * iod_scale),
+        total_od_time=jitter(100.0),
+        total_attribution_time=jitter(100.0),
+        merging_time=jitter(100.0),
+    )
+    thor_config = THORConfig(cell_area=10, backend="cf", cluster_min_obs=5, cluster_algorithm="dbscan")
+    manifest = {"resources": {"max_memory_used_kb": jitter(1e6)}}
+    return OutputLine.from_parts(
+        dataset, f"benchmark-thor-{dataset}", params, jitter(600.0), log_output, thor_config, manifest
+    )
+
+
+def runs(thor_version, dataset, iod_scale=1.0, n=5, seed=0):
+    rng = random.Random(f"{thor_version}-{dataset}-{seed}")
+    return [output_line(rng, thor_version, dataset, iod_scale) for _ in range(n)]
+
+
+def compare(lines, gate="group"):
+    args = argparse.Namespace(
+        baseline=BASELINE[:7],
+        candidate=CANDIDATE[:7],
+        max_slowdown=0.05,
+        max_memory_increase=0.10,
+        confidence=0.95,
+        n_bootstrap=500,
+        min_runs=2,
+        seed=0,
+        gate=gate,
+    )
+    groups = compare_results.pair_runs(lines, args.baseline, args.candidate)
+    return compare_results.compare(groups, args)
+
+
+def test_pair_runs_matches_abbreviated_versions():
+    lines = runs(BASELINE, "a", n=2) + runs(CANDIDATE, "a", n=3) + runs("cccccccc", "a", n=4)
+    groups = compare_results.pair_runs(lines, BASELINE[:7], CANDIDATE[:7])
+    assert len(groups) == 1
+    baseline, candidate = next(iter(groups.values()))
+    assert (len(baseline), len(candidate)) == (2, 3)
+
+
+def test_change_verdicts():
+    slower = [math.log(1.2)] * 100
+    assert Change.from_log_ratios(math.log(1.2), slower, 0.95, 0.05).verdict == "regression"
+    assert Change.from_log_ratios(math.log(1.2), slower, 0.95, 0.25).verdict == "no significant change"
+    faster = [math.log(0.8)] * 100
+    assert Change.from_log_ratios(math.log(0.8), faster, 0.95, 0.05).verdict == "improvement"
+    noisy = [math.log(0.9), math.log(1.3)] * 50
+    assert Change.from_log_ratios(math.log(1.2), noisy, 0.95, 0.05).verdict == "no significant change"
+
+
+def test_group_regression_fails_even_when_pooled_result_does_not():
+    lines = runs(BASELINE, "d0") + runs(CANDIDATE, "d0", iod_scale=1.4)
+    for dataset in ["d1", "d2", "d3", "d4"]:
+        lines += runs(BASELINE, dataset) + runs(CANDIDATE, dataset, iod_scale=0.9)
+
+    report = compare(lines)
+    assert report["stages"]["iod_time"]["verdict"] != "regression"
+    assert report["regressions"] == []
+    assert [(r["dataset"], r["metric"]) for r in report["group_regressions"]] == [("d0", "iod_time")]
+    assert compare_results.exit_code(report, "group") == 1
+    assert compare_results.exit_code(report, "pooled") == 0
+
+
+def test_identical_versions_show_no_significant_change():
+    lines = []
+    for dataset in ["d0", "d1"]:
+        lines += runs(BASELINE, dataset, seed=1) + runs(CANDIDATE, dataset, seed=2)
+
+    report = compare(lines)
+    assert set(report["stages"]) == set(compare_results.METRICS)
+    assert {stage["verdict"] for stage in report["stages"].values()} == {"no significant change"}
+    assert report["group_regressions"] == []
+    assert compare_results.exit_code(report, "group") == 0
+
+
+def test_no_comparable_groups():
+    lines = runs(BASELINE, "d0") + runs(CANDIDATE, "d1")
+
+    report = compare(lines)
+    assert report["stages"] == {}
+    assert len(report["skipped_groups"]) == 2
+    assert compare_results.exit_code(report, "group") == 2
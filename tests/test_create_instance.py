@@ -0,0 +1,64 @@
+from unittest import mock
+
+import pytest
+
+compute_v1 = pytest.importorskip("google.cloud.compute_v1")
+
+from google.api_core import exceptions
+from google.api_core.extended_operation import ExtendedOperation
+
+import create_instance
+
+
+class FakeOperation(ExtendedOperation):
+    # Same field names as the operations returned by compute_v1's InstancesClient.
+    @property
+    def error_message(self):
+        return self._extended_operation.http_error_message
+
+    @property
+    def error_code(self):
+        return self._extended_operation.http_error_status_code
+
+
+def failed_operation(status_code, code, message):
+    operation = compute_v1.Operation(
+        name="operation-1",
+        status=compute_v1.Operation.Status.DONE,
+        http_error_status_code=status_code,
+        http_error_message="Service Unavailable",
+        error=compute_v1.Error(errors=[compute_v1.Errors(code=code, message=message)]),
+    )
+    return FakeOperation.make(lambda: operation, lambda: None, operation)
+
+
+def run_create_instance(operation):
+    with mock.patch.object(compute_v1, "InstancesClient") as client:
+        client.return_value.insert.return_value = operation
+        return create_instance.create_instance(
+            project_id="project",
+            zone="us-central1-a",
+            instance_name="instance",
+            disks=[],
+            service_account=create_instance.service_account("sa@example.com", []),
+            machine_type="c2-standard-8",
+        )
+
+
+def test_resource_pool_exhausted_raises_capacity_error():
+    operation = failed_operation(
+        503,
+        "ZONE_RESOURCE_POOL_EXHAUSTED",
+        "The zone 'us-central1-a' does not have enough resources available.",
+    )
+    with pytest.raises(create_instance.CapacityError) as info:
+        run_create_instance(operation)
+    assert info.value.zone == "us-central1-a"
+    assert info.value.code == "ZONE_RESOURCE_POOL_EXHAUSTED"
+
+
+def test_other_operation_errors_are_raised_unchanged():
+    operation = failed_operation(400, "INVALID_FIELD_VALUE", "Invalid value for field.")
+    with pytest.raises(exceptions.GoogleAPICallError) as info:
+        run_create_instance(operation)
+    assert not isinstance(info.value, create_instance.CapacityError)
@@ -0,0 +1,154 @@
+"""
+Host tuning profiles applied to the benchmark instance before running THOR.
+
+Profiles are named and composable: each one contributes setup commands run
+once on the instance, environment variables and/or a command prefix for the
+THOR process. Profiles in the same group set the same knob and cannot be
+combined.
+"""
+from __future__ import annotations
+
+import dataclasses
+
+import ssh_instance
+
+# The first logical CPU of every physical core.
+PHYSICAL_CORES = "$(lscpu -p=CPU,CORE | grep -v '^#' | sort -t, -k2,2n -u | cut -d, -f1 | paste -sd,)"
+
+
+@dataclasses.dataclass
+class TuningProfile:
+    name: str
+    description: str
+    group: str
+    setup: list[str] = dataclasses.field(default_factory=list)
+    env: dict[str, str] = dataclasses.field(default_factory=dict)
+    prefix: str = ""
+    # Whether the profile can be used inside the cpusets of a packed run.
+    packable: bool = True
+    # Profiles in other groups that this one would silently override.
+    conflicts: list[str] = dataclasses.field(default_factory=list)
+
+
+def thp(mode: str) -> list[str]:
+    return [
+        f"echo {mode} | sudo tee /sys/kernel/mm/transparent_hugepage/enabled",
+        f"echo {'madvise' if mode == 'never' else mode} | sudo tee /sys/kernel/mm/transparent_hugepage/defrag",
+    ]
+
+
+PROFILES = {
+    profile.name: profile
+    for profile in [
+        TuningProfile(
+            name="no-smt",
+            description="Take SMT sibling threads offline",
+            group="smt",
+            setup=["echo off | sudo tee /sys/devices/system/cpu/smt/control"],
+        ),
+        TuningProfile(
+            name="thp-always",
+            description="Always back anonymous memory with transparent huge pages",
+            group="thp",
+            setup=thp("always"),
+        ),
+        TuningProfile(
+            name="thp-never",
+            description="Disable transparent huge pages",
+            group="thp",
+            setup=thp("never"),
+        ),
+        TuningProfile(
+            name="governor-performance",
+            description="Use the performance cpufreq governor, where the guest exposes one",
+            group="governor",
+            setup=[
+                "for f in /sys/devices/system/cpu/cpu*/cpufreq/scaling_governor; do "
+                "[ -e $f ] && echo performance | sudo tee $f; done; true"
+            ],
+        ),
+        TuningProfile(
+            name="jemalloc",
+            description="Preload jemalloc as the allocator",
+            group="malloc",
+            setup=["sudo apt-get install -y libjemalloc2"],
+            env={"LD_PRELOAD": "$(ls /usr/lib/*-linux-gnu/libjemalloc.so.2)"},
+        ),
+        TuningProfile(
+            name="tcmalloc",
+            description="Preload tcmalloc as the allocator",
+            group="malloc",
+            setup=["sudo apt-get install -y libtcmalloc-minimal4"],
+            env={"LD_PRELOAD": "$(ls /usr/lib/*-linux-gnu/libtcmalloc_minimal.so.4)"},
+        ),
+        TuningProfile(
+            name="numa-node0",
+            description="Bind THOR's CPUs and memory to NUMA node 0",
+            group="numa",
+            setup=["sudo apt-get install -y numactl"],
+            prefix="numactl --cpunodebind=0 --membind=0",
+            packable=False,
+        ),
+        TuningProfile(
+            name="numa-interleave",
+            description="Interleave THOR's memory across all NUMA nodes",
+            group="numa",
+            setup=["sudo apt-get install -y numactl"],
+            prefix="numactl --interleave=all",
+        ),
+        TuningProfile(
+            name="pin-physical-cores",
+            description="Restrict THOR to one logical CPU per physical core",
+            group="affinity",
+            prefix=f"taskset -c {PHYSICAL_CORES}",
+            packable=False,
+            # The CPU list spans every node and would replace --cpunodebind.
+            conflicts=["numa-node0"],
+        ),
+    ]
+}
+
+
+def resolve_profiles(names: list[str]) -> list[TuningProfile]:
+    """
+    Look up the named profiles, dropping duplicates and rejecting
+    combinations that set the same knob twice. Profiles are returned in
+    definition order so wrappers always nest the same way.
+    """
+    profiles = []
+    groups = {}
+    for name in dict.fromkeys(names):
+        if name not in PROFILES:
+            raise ValueError(f"Unknown tuning profile {name}, expected one of {sorted(PROFILES)}")
+        profile = PROFILES[name]
+        if profile.group in groups:
+            raise ValueError(
+                f"Tuning profiles {groups[profile.group]} and {name} both set {profile.group}"
+            )
+        groups[profile.group] = name
+        profiles.append(profile)
+    for profile in profiles:
+        for other in profile.conflicts:
+            if other in groups.values():
+                raise ValueError(f"Tuning profiles {profile.name} and {other} cannot be combined")
+    order = list(PROFILES)
+    return sorted(profiles, key=lambda p: order.index(p.name))
+
+
+def apply_profiles(ssh: ssh_instance.SSH, profiles: list[TuningProfile]):
+    for profile in profiles:
+        print(f"applying tuning profile {profile.name}: {profile.description}")
+        for command in profile.setup:
+            ssh.execute_command(command)
+
+
+def wrap_command(profiles: list[TuningProfile], command: str) -> str:
+    """
+    Prefix a shell command with the environment and wrappers of the
+    profiles.
+    """
+    env = " ".join(
+        f'{key}="{value}"' for profile in profiles for key, value in profile.env.items()
+    )
+    prefix = " ".join(profile.prefix for profile in profiles if profile.prefix)
+    return " ".join(part for part in [env, prefix, command] if part)
@@ -0,0 +1,100 @@
+"""
+Zone selection for benchmark instances.
+
+Each machine family has a list of candidate zones. Launch outcomes are
+cached locally per machine type and zone so that later launches try the
+zones that are likely to have capacity first.
+"""
+from __future__ import annotations
+
+import datetime
+import json
+import os
+
+# Candidate zones, in order of preference, by machine family (the part of
+# the machine type before the first '-'). Families not listed use DEFAULT_ZONES.
+DEFAULT_ZONES = ["us-central1-a", "us-central1-b", "us-central1-c", "us-central1-f"]
+MACHINE_FAMILY_ZONES = {
+    "t2a": ["us-central1-a", "us-central1-b", "us-central1-f"],
+    "c2": ["us-central1-a", "us-central1-b", "us-central1-c", "us-central1-f", "us-east1-b", "us-east1-c"],
+    "c2d": ["us-central1-a", "us-central1-b", "us-central1-c", "us-central1-f", "us-east1-b", "us-east1-c"],
+}
+
+# Outcome recorded when the zone does not offer the machine type at all,
+# the code of the create_instance.CapacityError raised in that case.
+NOT_OFFERED = "MACHINE_TYPE_NOT_OFFERED"
+
+CACHE_PATH = os.path.expanduser("~/.cache/thor-bench/zone-availability.json")
+# How long a capacity or quota failure pushes a zone to the back of the list.
+FAILURE_TTL = datetime.timedelta(hours=6)
+# How long a zone that does not offer a machine type is skipped entirely.
+NOT_OFFERED_TTL = datetime.timedelta(days=30)
+
+
+def region(zone: str) -> str:
+    # eg us-central1-a becomes us-central1
+    region, _ = zone.rsplit("-", 1)
+    return region
+
+
+def candidate_zones(machine_type: str) -> list[str]:
+    family = machine_type.split("-")[0]
+    return MACHINE_FAMILY_ZONES.get(family, DEFAULT_ZONES)
+
+
+class ZoneAvailabilityCache:
+    """
+    Launch outcomes per machine type and zone, persisted as JSON:
+
+        {machine_type: {zone: {"successes": int, "failures": int,
+                               "last_outcome": str, "last_attempt": iso time}}}
+    """
+
+    def __init__(self, path: str = CACHE_PATH):
+        self.path = path
+        try:
+            with open(path) as f:
+                self.entries = json.load(f)
+        except (OSError, json.decoder.JSONDecodeError):
+            self.entries = {}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "w") as f:
+            json.dump(self.entries, f, indent=2)
+
+    def record(self, machine_type: str, zone: str, outcome: str):
+        """
+        Record the outcome of a launch: "ok", or the error code it failed with.
+        """
+        entry = self.entries.setdefault(machine_type, {}).setdefault(
+            zone, {"successes": 0, "failures": 0}
+        )
+        if outcome == "ok":
+            entry["successes"] += 1
+        else:
+            entry["failures"] += 1
+        entry["last_outcome"] = outcome
+        entry["last_attempt"] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        self.save()
+
+    def order(self, machine_type: str, zones: list[str]) -> list[str]:
+        """
+        Order zones so that ones without a recent failure come first, then
+        by past success rate, keeping the configured order as tie-breaker.
+        Zones known not to offer the machine type are dropped.
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        ranked = []
+        for index, zone in enumerate(zones):
+            entry = self.entries.get(machine_type, {}).get(zone)
+            if entry is None:
+                ranked.append((False, 0.0, index, zone))
+                continue
+            since_attempt = now - datetime.datetime.fromisoformat(entry["last_attempt"])
+            if entry["last_outcome"] == NOT_OFFERED and since_attempt < NOT_OFFERED_TTL:
+                continue
+            recent_failure = entry["last_outcome"] != "ok" and since_attempt < FAILURE_TTL
+            attempts = entry["successes"] + entry["failures"]
+            ranked.append((recent_failure, -entry["successes"] / attempts, index, zone))
+        return [zone for *_, zone in sorted(ranked)]